@@ -0,0 +1,388 @@
+import argparse
+import base64
+import io
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+IMAGE_SIZES = {
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+IMAGE_PATHS = ['png_roundtrip', 'direct', 'paste_qt', 'paste_pillow']
+INGEST_WORKLOADS = ['text_burst', 'screenshots', 'file_lists', 'mixed']
+PASTE_STORAGES = ['db', 'segment', 'segment_mmap', 'image']
+SEARCH_QUERIES = ['error', 'request 42', 'timeout upstream', 'user', 'zzz-no-match']
+FUZZY_QUERIES = ['error', 'timout upstrem', 'req 42', 'zzz-no-match']
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    import psutil
+    return psutil.Process(os.getpid()).memory_info().rss / 1024 ** 2
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'runs': 0}
+    p99 = samples[min(len(samples) - 1, int(round(0.99 * (len(samples) - 1))))]
+    return {
+        'runs': len(samples),
+        'min_ms': round(samples[0] * 1000, 2),
+        'p50_ms': round(statistics.median(samples) * 1000, 2),
+        'p99_ms': round(p99 * 1000, 2),
+        'max_ms': round(samples[-1] * 1000, 2),
+    }
+
+
+def disk_usage(vault):
+    def size(path):
+        return os.path.getsize(path) if os.path.exists(path) else 0
+    db_bytes = sum(size(vault.db_path + suffix) for suffix in ('', '-wal', '-shm'))
+    data_bytes = 0
+    for root, dirs, files in os.walk(vault.data_dir):
+        data_bytes += sum(size(os.path.join(root, name)) for name in files)
+    return {'db_bytes': db_bytes, 'data_bytes': data_bytes}
+
+
+def pump_until(app, done, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while not done() and time.perf_counter() < deadline:
+        app.processEvents()
+        time.sleep(0.0005)
+    return done()
+
+
+def make_screenshot(width, height, seed=0):
+    from PyQt5.QtGui import QImage, QPainter, QColor, QFont
+    img = QImage(width, height, QImage.Format_ARGB32)
+    img.fill(QColor(240, 240, 240))
+    painter = QPainter(img)
+    for x in range(0, width, 37):
+        painter.fillRect(x, (x * 7 + seed * 13) % height, 30, height // 5,
+                         QColor((x + seed) % 255, (x * 3) % 255, 120))
+    painter.setFont(QFont("Arial", 14))
+    for y in range(40, height, 60):
+        painter.drawText(20, y, f"ClipVault benchmark {seed} " * (width // 200))
+    painter.end()
+    return img
+
+
+def make_log_text(lines, seed=0):
+    return ''.join(f"2026-10-17 12:{i % 60:02d}:{seed % 60:02d} INFO user{i % 97} request {seed}-{i} "
+                   f"served in {(i * 7) % 500} ms\n" for i in range(lines))
+
+
+def open_vault(workdir):
+    os.environ['CLIPVAULT_HOME'] = workdir
+    os.environ['XDG_RUNTIME_DIR'] = workdir
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    return main, main.ClipVault()
+
+
+def run_image_case(size, path, runs):
+    from PyQt5.QtCore import QBuffer
+    from PyQt5.QtGui import QImage
+    from PIL import Image
+    with tempfile.TemporaryDirectory() as workdir:
+        main, vault = open_vault(workdir)
+        img = make_screenshot(*IMAGE_SIZES[size])
+        jpeg = vault._compress_qimage(img)
+        keep = []
+
+        def png_roundtrip():
+            buffer = QBuffer()
+            buffer.open(QBuffer.ReadWrite)
+            img.save(buffer, "PNG")
+            return vault._compress_image(bytes(buffer.data()))
+
+        def direct():
+            return vault._compress_qimage(img)
+
+        def paste_qt():
+            decoded = QImage()
+            decoded.loadFromData(jpeg)
+            return decoded
+
+        def paste_pillow():
+            pixels = Image.open(io.BytesIO(jpeg)).convert('RGB')
+            data = pixels.tobytes()
+            keep[:] = [data]
+            return QImage(data, pixels.width, pixels.height, pixels.width * 3, QImage.Format_RGB888)
+
+        work = {'png_roundtrip': png_roundtrip, 'direct': direct,
+                'paste_qt': paste_qt, 'paste_pillow': paste_pillow}[path]
+        rss_before = current_rss_mb()
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            work()
+            samples.append(time.perf_counter() - start)
+        result = summarize(samples)
+        result.update({
+            'suite': 'images', 'case': size, 'path': path,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'peak_rss_delta_mb': round(max(0.0, peak_rss_mb() - rss_before), 1),
+        })
+        vault.cleanup()
+        return result
+
+
+def ingest_events(workload, count):
+    from PyQt5.QtCore import QMimeData, QUrl
+    for i in range(count):
+        kind = workload
+        if workload == 'mixed':
+            kind = ('text_burst', 'text_burst', 'file_lists', 'screenshots')[i % 4]
+        if kind == 'text_burst':
+            yield 'text', f"snippet {i}: " + make_log_text(1 + i % 20, i)
+        elif kind == 'file_lists':
+            mime = QMimeData()
+            mime.setUrls([QUrl.fromLocalFile(f"/home/user/project/file_{i}_{n}.txt") for n in range(1 + i % 8)])
+            yield 'mime', mime
+        else:
+            yield 'image', make_screenshot(3840, 2160, seed=i)
+
+
+def run_ingest_case(workload, runs):
+    with tempfile.TemporaryDirectory() as workdir:
+        main, vault = open_vault(workdir)
+        stored = []
+        vault.ingest.stored.connect(lambda id: stored.append(time.perf_counter()), main.Qt.QueuedConnection)
+        count = {'text_burst': runs * 20, 'mixed': runs * 4}.get(workload, runs)
+        events = list(ingest_events(workload, count))
+        rss_before = current_rss_mb()
+        submitted = []
+        start = time.perf_counter()
+        for kind, payload in events:
+            submitted.append(time.perf_counter())
+            if kind == 'text':
+                vault.clipboard.setText(payload)
+            elif kind == 'mime':
+                vault.clipboard.setMimeData(payload)
+            else:
+                vault.clipboard.setImage(payload)
+            pump_until(vault.app, lambda: len(stored) >= len(submitted))
+        elapsed = time.perf_counter() - start
+        latencies = [done - begin for begin, done in zip(submitted, stored)]
+        result = summarize(latencies)
+        usage = disk_usage(vault)
+        result.update({
+            'suite': 'ingest', 'case': workload, 'events': len(submitted), 'persisted': len(stored),
+            'debounce_ms': vault.clipboard_debounce_ms,
+            'throughput_per_s': round(len(stored) / elapsed, 1) if elapsed else None,
+            'db_bytes': usage['db_bytes'], 'data_bytes': usage['data_bytes'],
+            'bytes_per_clip': round((usage['db_bytes'] + usage['data_bytes']) / max(1, len(stored))),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'peak_rss_delta_mb': round(max(0.0, peak_rss_mb() - rss_before), 1),
+        })
+        vault.cleanup()
+        return result
+
+
+def paste_fixture(vault, storage):
+    if storage == 'db':
+        return vault.store_content("short snippet for paste", 'text')
+    if storage == 'segment':
+        return vault.store_content(base64.b64encode(os.urandom(2 * 1024 * 1024)).decode(), 'text')
+    if storage == 'segment_mmap':
+        return vault.store_content(base64.b64encode(os.urandom(12 * 1024 * 1024)).decode(), 'text')
+    return vault.store_content(make_screenshot(3840, 2160), 'image')
+
+
+def run_paste_case(storage, runs):
+    with tempfile.TemporaryDirectory() as workdir:
+        main, vault = open_vault(workdir)
+        vault.set_cache_budget(128)
+        paste_fixture(vault, storage)
+        id = vault.history[0][0]
+        rss_before = current_rss_mb()
+        timings = {'miss': [], 'hit': []}
+        for _ in range(runs):
+            vault.cache.clear()
+            start = time.perf_counter()
+            vault.paste_item(id)
+            timings['miss'].append(time.perf_counter() - start)
+            vault.get_content(id)
+            start = time.perf_counter()
+            vault.paste_item(id)
+            timings['hit'].append(time.perf_counter() - start)
+        row = vault.db.execute('''SELECT b.storage, b.codec, b.size FROM clips c
+                               JOIN blobs b ON b.hash = c.hash WHERE c.id=?''', (id,)).fetchone()
+        result = {
+            'suite': 'paste', 'case': storage, 'storage': row[0], 'codec': row[1], 'stored_bytes': row[2],
+            'cache_miss': summarize(timings['miss']), 'cache_hit': summarize(timings['hit']),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'peak_rss_delta_mb': round(max(0.0, peak_rss_mb() - rss_before), 1),
+        }
+        result.update({'runs': runs, 'p50_ms': result['cache_miss']['p50_ms']})
+        vault.cleanup()
+        return result
+
+
+def run_search_case(clips, runs):
+    with tempfile.TemporaryDirectory() as workdir:
+        main, vault = open_vault(workdir)
+        start = time.perf_counter()
+        vault.db.execute("BEGIN")
+        for i in range(clips):
+            vault._persist(vault.db, make_log_text(3, i) + (" error timeout upstream" if i % 50 == 0 else ""), 'text')
+        vault.db.commit()
+        populate_s = time.perf_counter() - start
+        rss_before = current_rss_mb()
+        samples = []
+        per_query = {}
+        for query in SEARCH_QUERIES:
+            query_samples = []
+            for _ in range(runs):
+                begin = time.perf_counter()
+                vault.search(query)
+                query_samples.append(time.perf_counter() - begin)
+            per_query[query] = summarize(query_samples)
+            samples.extend(query_samples)
+        result = summarize(samples)
+        rss_fuzzy = current_rss_mb()
+        start = time.perf_counter()
+        vault.fuzzy_pending = []
+        vault._build_fuzzy_index()
+        fuzzy_build_s = time.perf_counter() - start
+        keystrokes = []
+        for query in FUZZY_QUERIES:
+            for end in range(1, len(query) + 1):
+                for _ in range(runs):
+                    begin = time.perf_counter()
+                    vault.fuzzy_search(query[:end])
+                    keystrokes.append(time.perf_counter() - begin)
+        usage = disk_usage(vault)
+        result.update({
+            'suite': 'search', 'case': f"{clips}_clips", 'clips': clips, 'populate_s': round(populate_s, 2),
+            'queries': per_query, 'db_bytes': usage['db_bytes'],
+            'fuzzy': dict(summarize(keystrokes), build_s=round(fuzzy_build_s, 2),
+                          index_bytes=vault.fuzzy_index.stats()['bytes'],
+                          rss_delta_mb=round(max(0.0, current_rss_mb() - rss_fuzzy), 1)),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'peak_rss_delta_mb': round(max(0.0, peak_rss_mb() - rss_before), 1),
+        })
+        vault.cleanup()
+        return result
+
+
+def run_child(args):
+    if args.suite == 'images':
+        result = run_image_case(args.case, args.path, args.runs)
+    elif args.suite == 'ingest':
+        result = run_ingest_case(args.case, args.runs)
+    elif args.suite == 'paste':
+        result = run_paste_case(args.case, args.runs)
+    else:
+        result = run_search_case(int(args.case), args.runs)
+    print(json.dumps(result))
+
+
+def spawn(suite, case, runs, path=None):
+    cmd = [sys.executable, os.path.abspath(__file__), '--child', suite,
+           '--case', str(case), '--runs', str(runs)]
+    if path:
+        cmd += ['--path', path]
+    out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def report_line(result, label):
+    p99 = f"p99 {result['p99_ms']:>9.1f} ms  " if 'p99_ms' in result else ""
+    print(f"{result['suite']:>7} {label:<22} p50 {result['p50_ms']:>9.1f} ms  {p99}"
+          f"peak +{result['peak_rss_delta_mb']:>7.1f} MB")
+
+
+def bench_images(args):
+    results = []
+    for size in args.sizes.split(','):
+        for path in IMAGE_PATHS:
+            result = spawn('images', size, args.runs, path)
+            report_line(result, f"{size} {path}")
+            results.append(result)
+    return results
+
+
+def bench_ingest(args):
+    results = []
+    for workload in INGEST_WORKLOADS:
+        result = spawn('ingest', workload, args.runs)
+        report_line(result, workload)
+        results.append(result)
+    return results
+
+
+def bench_paste(args):
+    results = []
+    for storage in PASTE_STORAGES:
+        result = spawn('paste', storage, args.runs)
+        for kind in ('cache_miss', 'cache_hit'):
+            print(f"  paste {storage:<12} {kind:<10} p50 {result[kind]['p50_ms']:>9.2f} ms  "
+                  f"p99 {result[kind]['p99_ms']:>9.2f} ms")
+        results.append(result)
+    return results
+
+
+def bench_search(args):
+    result = spawn('search', args.clips, args.runs)
+    report_line(result, f"{args.clips} clips")
+    report_line(dict(result['fuzzy'], suite='fuzzy', peak_rss_delta_mb=result['fuzzy']['rss_delta_mb']),
+                f"{args.clips} clips/keystroke")
+    return [result]
+
+
+SUITES = {
+    'images': bench_images,
+    'ingest': bench_ingest,
+    'paste': bench_paste,
+    'search': bench_search,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ClipVault headless benchmarks")
+    parser.add_argument('suite', choices=sorted(SUITES) + ['all'])
+    parser.add_argument('--sizes', default=','.join(IMAGE_SIZES))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--clips', type=int, default=20000, help="history size for the search suite")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    parser.add_argument('--path', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_child(args)
+        return
+    suites = sorted(SUITES) if args.suite == 'all' else [args.suite]
+    results = []
+    for suite in suites:
+        results.extend(SUITES[suite](args))
+    report = {
+        'suite': args.suite,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': sys.platform,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
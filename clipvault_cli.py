@@ -0,0 +1,143 @@
+import argparse
+import getpass
+import json
+import os
+import socket
+import sys
+import tempfile
+
+IPC_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+                          f"clipvault-{getpass.getuser()}.sock")
+CHUNK_SIZE = 1024 * 1024
+
+
+class ClipVaultClient:
+    def __init__(self, path=IPC_SOCKET):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.stream = self.sock.makefile('rwb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def request(self, op, **params):
+        self.stream.write(json.dumps(dict(params, op=op)).encode('utf-8') + b'\n')
+        self.stream.flush()
+
+    def message(self):
+        line = self.stream.readline()
+        if not line:
+            raise ConnectionError("ClipVault closed the connection")
+        message = json.loads(line)
+        if message.get('ok') is False:
+            raise RuntimeError(message.get('error', 'request failed'))
+        return message
+
+    def rows(self, op, **params):
+        self.request(op, **params)
+        while True:
+            message = self.message()
+            if message.get('done'):
+                self.last = message
+                return
+            yield message
+
+    def get(self, id, out):
+        self.request('get', id=id)
+        header = self.message()
+        remaining = header['size']
+        while remaining:
+            chunk = self.stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ConnectionError("ClipVault closed the connection")
+            out.write(chunk)
+            remaining -= len(chunk)
+        return header
+
+    def command(self, op, id):
+        self.request(op, id=id)
+        return self.message()
+
+
+def print_rows(rows, as_json):
+    for row in rows:
+        if as_json:
+            print(json.dumps(row))
+        else:
+            preview = ' '.join(row['preview'].split())
+            print(f"{row['id']}\t{row['type']}\t{'*' if row['pinned'] else ' '}\t{preview}")
+
+
+def transfer(client, op, path, as_json):
+    for message in client.rows(op, path=path):
+        if not as_json:
+            print(f"\r{op}: {message['progress'] * 100 // max(message['total'], 1)}%", end='', file=sys.stderr)
+    summary = {key: value for key, value in client.last.items() if key not in ('ok', 'done')}
+    if as_json:
+        print(json.dumps(summary))
+    else:
+        print(f"\r{op}: " + ", ".join(f"{value} {key}" for key, value in summary.items()), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a running ClipVault")
+    parser.add_argument('--socket', default=IPC_SOCKET)
+    parser.add_argument('--json', action='store_true', help="print rows as JSON lines")
+    commands = parser.add_subparsers(dest='command', required=True)
+    list_parser = commands.add_parser('list', help="list history, newest first")
+    list_parser.add_argument('--limit', type=int, default=50, help="0 lists everything")
+    list_parser.add_argument('--pinned', action='store_true')
+    search_parser = commands.add_parser('search', help="full-text search")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--limit', type=int, default=50)
+    search_parser.add_argument('--offset', type=int, default=0)
+    fuzzy_parser = commands.add_parser('fuzzy', help="typo-tolerant search, best matches first")
+    fuzzy_parser.add_argument('query')
+    fuzzy_parser.add_argument('--limit', type=int, default=20)
+    commands.add_parser('quickpick', help="open the quick-pick popup")
+    get_parser = commands.add_parser('get', help="write a clip's raw content")
+    get_parser.add_argument('id', type=int)
+    get_parser.add_argument('-o', '--output', help="file to write, defaults to stdout")
+    for op in ('pin', 'unpin', 'delete', 'paste'):
+        commands.add_parser(op).add_argument('id', type=int)
+    commands.add_parser('export', help="write the whole vault to an archive").add_argument('path')
+    commands.add_parser('import', help="merge an archive into the vault").add_argument('path')
+    args = parser.parse_args()
+    try:
+        with ClipVaultClient(args.socket) as client:
+            if args.command == 'list':
+                print_rows(client.rows('list', limit=args.limit or None, pinned=args.pinned), args.json)
+            elif args.command == 'search':
+                print_rows(client.rows('search', query=args.query, limit=args.limit, offset=args.offset), args.json)
+            elif args.command == 'fuzzy':
+                print_rows(client.rows('fuzzy', query=args.query, limit=args.limit), args.json)
+            elif args.command == 'quickpick':
+                client.command('quickpick', 0)
+            elif args.command == 'get':
+                if args.output:
+                    with open(args.output, 'wb') as f:
+                        client.get(args.id, f)
+                else:
+                    client.get(args.id, sys.stdout.buffer)
+                    sys.stdout.buffer.flush()
+            elif args.command in ('export', 'import'):
+                transfer(client, args.command, os.path.abspath(args.path), args.json)
+            else:
+                client.command(args.command, args.id)
+    except BrokenPipeError:
+        return 0
+    except (OSError, RuntimeError) as e:
+        print(f"clipvault: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,32 +2,2013 @@ import sys
 import sqlite3
 import mmap
 import os
+import re
+import hashlib
+import queue
+import threading
+import time
+import codecs
+import zlib
+import lzma
 import shutil
+import json
+import bisect
+import struct
+import heapq
+import socket
+import socketserver
+import tempfile
+import getpass
+import logging
+import logging.handlers
+import gc
+import weakref
+import ctypes
 from datetime import datetime
-from collections import OrderedDict
+from array import array
+from collections import OrderedDict, Counter, deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from PyQt5.QtWidgets import (
     QApplication, QSystemTrayIcon, QMenu, QAction, QMainWindow, QWidget,
-    QVBoxLayout, QHBoxLayout, QListWidget, QListWidgetItem, QPushButton,
-    QLabel, QLineEdit, QComboBox, QCheckBox, QSlider, QTabWidget
+    QVBoxLayout, QHBoxLayout, QListView, QPushButton,
+    QLabel, QLineEdit, QComboBox, QCheckBox, QSlider, QTabWidget, QFileDialog
 )
 from PyQt5.QtGui import (
-    QClipboard, QImage, QIcon, QPixmap, QPainter, QFont, QPalette, QColor
+    QClipboard, QImage, QIcon, QPixmap, QPixmapCache, QPainter, QFont, QPalette, QColor
 )
 from PyQt5.QtCore import (
-    QBuffer, QIODevice, QUrl, QMimeData, QTimer, Qt, QSize
+    QBuffer, QIODevice, QUrl, QMimeData, QTimer, Qt, QSize, QObject, QThread,
+    QAbstractListModel, QModelIndex, QEvent, pyqtSignal, pyqtSlot
 )
-from PIL import Image
 import io
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_DEBOUNCE_MS = 200
+SEARCH_INDEX_LIMIT = 1024 * 1024
+HISTORY_PAGE_SIZE = 200
+BULK_CHANGE_THRESHOLD = 100
+TRAY_ITEMS = 5
+NOW_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+INGEST_QUEUE_SIZE = 8
+INGEST_PUT_TIMEOUT = 0.5
+INGEST_BATCH_SIZE = 32
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-4096",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+SCHEMA_MIGRATIONS = (
+    '_migrate_base_schema',
+    '_ensure_blob_store',
+    '_ensure_search_index',
+    '_migrate_history_indexes',
+    '_migrate_retention',
+    '_migrate_codecs',
+    '_migrate_segments',
+    '_migrate_paste_counts',
+    '_migrate_thumbnails',
+    '_migrate_perceptual_hashes',
+    '_migrate_change_log',
+    '_migrate_unreferenced_index',
+    '_migrate_change_origin',
+    '_migrate_absolute_paths',
+    '_migrate_relative_paths',
+    '_migrate_blank_phashes',
+)
+LZMA_DICT_BYTES = 1024 * 1024
+LZMA_FILTERS = lambda level: [{'id': lzma.FILTER_LZMA2, 'preset': level, 'dict_size': LZMA_DICT_BYTES}]
+CODECS = {
+    'zlib': (zlib.compress, zlib.decompressobj, 3, 9, zlib.compressobj),
+    'lzma': (lambda data, level: lzma.compress(data, filters=LZMA_FILTERS(level)), lzma.LZMADecompressor, 0, 6,
+             lambda level: lzma.LZMACompressor(filters=LZMA_FILTERS(level))),
+}
+if zstandard is not None:
+    CODECS['zstd'] = (lambda data, level: zstandard.ZstdCompressor(level=level).compress(data),
+                      lambda: zstandard.ZstdDecompressor().decompressobj(), 3, 19,
+                      lambda level: zstandard.ZstdCompressor(level=level).compressobj())
+INGEST_CODEC = 'zstd' if 'zstd' in CODECS else 'zlib'
+COLD_CODEC = 'lzma'
+COMPRESSION_THRESHOLD = 64 * 1024
+COLD_RECOMPRESS_BATCH = 20
+RETENTION_INTERVAL_MS = 60 * 1000
+RETENTION_BATCH = 200
+ORPHAN_SCAN_BATCH = 500
+ORPHAN_GRACE_SECONDS = 3600
+RETENTION_DEFAULTS = {
+    'max_age_hours': 24,
+    'max_items': 100000,
+    'max_total_bytes': 1024 ** 3,
+    'type_quotas': {'image': 512 * 1024 ** 2},
+    'recompress_cold_hours': 6,
+}
+RGB32_RAWMODE = 'BGRX' if sys.byteorder == 'little' else 'XRGB'
+CACHE_BUDGET_MB = 16
+CACHE_TYPE_WEIGHTS = {'text': 0.25, 'file': 0.05, 'image': 0.7}
+CACHE_MAX_ITEM_FRACTION = 0.5
+PREFETCH_FREQUENT = 10
+PREFETCH_DEBOUNCE_MS = 100
+THUMBNAIL_SIZE = 64
+THUMBNAIL_VIEW_SIZE = 32
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_CACHE_KB = 4096
+THUMBNAIL_BACKFILL_BATCH = 20
+SIMILAR_IMAGE_DISTANCE = 6
+SIMILAR_IMAGE_LIMIT = 200
+SIMILAR_QUERY = re.compile(r'^similar:(\d+)$')
+FOLD_IMAGE_DISTANCE = 2
+STREAM_CHUNK_SIZE = 1024 * 1024
+STREAM_INGEST_THRESHOLD = 4 * 1024 * 1024
+MAX_CLIP_BYTES = 256 * 1024 * 1024
+MAX_CLIP_POLICIES = {'truncate': "Truncate", 'reference': "Keep preview only", 'reject': "Skip"}
+MAX_CLIP_POLICY = 'truncate'
+SEGMENT_THRESHOLD = 1024 * 1024
+MMAP_THRESHOLD = 10 * 1024 * 1024
+SEGMENT_DIR = "segments"
+SEGMENT_SUFFIX = ".seg"
+SEGMENT_MAX_BYTES = 256 * 1024 * 1024
+SEGMENT_COMPACT_RATIO = 0.5
+SEGMENT_MIGRATE_BATCH = 20
+SEGMENT_LOCK = ".append.lock"
+INSTANCE_LOCK = ".instances.lock"
+MAINTENANCE_LOCK = ".maintenance.lock"
+VAULT_HOME = os.environ.get('CLIPVAULT_HOME')
+CHANGE_POLL_MS = 500
+CHANGE_BATCH_LIMIT = 500
+CHANGES_KEEP = 10000
+ARCHIVE_MAGIC = b'CLIPVAULT-ARCHIVE\n'
+ARCHIVE_VERSION = 1
+ARCHIVE_FRAME = struct.Struct('>cIQ')
+ARCHIVE_BATCH = 500
+ARCHIVE_BATCH_BYTES = 64 * 1024 * 1024
+ARCHIVE_PROGRESS_SECONDS = 0.2
+METRICS_LOG = "metrics.log"
+METRICS_LOG_BYTES = 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+METRICS_INTERVAL_MS = 10 * 1000
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9464
+CLIPBOARD_DEBOUNCE_MS = 150
+CLIPBOARD_OWNER_MIME = 'application/x-clipvault-owner'
+IPC_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir(),
+                          f"clipvault-{getpass.getuser()}.sock")
+IPC_COMMANDS = ('pin', 'unpin', 'delete', 'paste')
+IPC_TRANSFERS = ('export', 'import')
+FUZZY_TEXT_LIMIT = 96
+FUZZY_PATH_BYTES = 400
+FUZZY_RESULTS = 20
+FUZZY_CANDIDATES = 200
+FUZZY_KEY_POSTINGS = 2000
+FUZZY_SCAN_BYTES = 64 * 1024
+FUZZY_RECENCY_WEIGHT = 0.2
+FUZZY_PIN_BOOST = 0.5
+FUZZY_COMPACT_MIN = 1024
+FUZZY_WORD_STARTS = b' /\\._-:'
+FUZZY_WORD = re.compile(rb'[^\W_]+')
+QUICK_PICK_WIDTH = 560
+QUICK_PICK_HEIGHT = 360
+IPC_REPLY_TIMEOUT = 10
+STARTUP_BUDGET_MS = 300
+STARTUP_IDLE_DELAY_MS = 3000
+MEMORY_CEILING_MB = 80
+GOVERNOR_STAGES = ('cache', 'pixmaps', 'mappings', 'sqlite', 'malloc')
+GOVERNOR_CACHE_FRACTION = 0.5
+GOVERNOR_MAX_BACKOFF = 32
+METRICS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+def compress_payload(data, codec, level=None):
+    compress, decompressor, fast_level, max_level, compressor = CODECS[codec]
+    return compress(data, fast_level if level is None else level)
+
+def compressor_for(codec, level=None):
+    compress, decompressor, fast_level, max_level, compressor = CODECS[codec]
+    return compressor(fast_level if level is None else level)
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+def dhash(image):
+    small = image.scaled(9, 8, Qt.IgnoreAspectRatio, Qt.SmoothTransformation).convertToFormat(
+        QImage.Format_Grayscale8)
+    value = 0
+    for y in range(8):
+        row = [small.pixel(x, y) & 0xff for x in range(9)]
+        for x in range(8):
+            value = value << 1 | (row[x] > row[x + 1])
+    return value
+
+def iter_chunks(view, size=STREAM_CHUNK_SIZE):
+    for start in range(0, len(view), size):
+        yield view[start:start + size]
+
+def decompress_chunks(chunks, codec):
+    if codec not in CODECS:
+        raise LookupError(f"{codec} codec is not installed")
+    decompressor = CODECS[codec][1]()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    flush = getattr(decompressor, 'flush', None)
+    if flush:
+        tail = flush()
+        if tail:
+            yield tail
+
+class ClipTrace:
+    def __init__(self, ctype):
+        self.ctype = ctype
+        self.start = self.last = time.perf_counter()
+        self.stages = {}
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def total(self):
+        return self.last - self.start
+
+class Histogram:
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.tracing = False
+        self.log = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timed(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def finish_trace(self, trace, id):
+        for stage, seconds in trace.stages.items():
+            self.observe('clipvault_ingest_stage_seconds', seconds, stage=stage)
+        self.observe('clipvault_ingest_seconds', trace.total(), type=trace.ctype)
+        if self.tracing:
+            self.write({'event': 'trace', 'id': id, 'type': trace.ctype,
+                        'total_ms': round(trace.total() * 1000, 3),
+                        'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in trace.stages.items()}})
+
+    def open_log(self, path, max_bytes=METRICS_LOG_BYTES, backups=METRICS_LOG_BACKUPS):
+        self.log = logging.getLogger(f"clipvault.metrics.{id(self)}")
+        self.log.propagate = False
+        self.log.setLevel(logging.INFO)
+        self.log.addHandler(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups))
+
+    def close_log(self):
+        if self.log is None:
+            return
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+            handler.close()
+        self.log = None
+
+    def write(self, record):
+        if self.log is not None:
+            self.log.info(json.dumps(dict(record, time=datetime.now().isoformat())))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': {self._name(key): value for key, value in self.counters.items()},
+                'gauges': {self._name(key): value for key, value in self.gauges.items()},
+                'histograms': {self._name(key): {
+                    'count': histogram.count,
+                    'sum': round(histogram.sum, 6),
+                    'p50': histogram.quantile(0.5),
+                    'p99': histogram.quantile(0.99),
+                } for key, histogram in self.histograms.items()},
+            }
+
+    def _name(self, key, extra=()):
+        name, labels = key
+        labels = labels + tuple(extra)
+        if not labels:
+            return name
+        return name + '{' + ','.join(f'{label}="{value}"' for label, value in labels) + '}'
+
+    def prometheus_text(self):
+        lines = []
+        typed = set()
+        with self.lock:
+            for kind, metrics in (('counter', self.counters), ('gauge', self.gauges)):
+                for key, value in sorted(metrics.items(), key=lambda item: str(item[0])):
+                    if key[0] not in typed:
+                        typed.add(key[0])
+                        lines.append(f"# TYPE {key[0]} {kind}")
+                    lines.append(f"{self._name(key)} {value}")
+            for key, histogram in sorted(self.histograms.items(), key=lambda item: str(item[0])):
+                name = key[0]
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {name} histogram")
+                seen = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    seen += count
+                    lines.append(f"{self._name((name + '_bucket', key[1]), (('le', bound),))} {seen}")
+                lines.append(f"{self._name((name + '_bucket', key[1]), (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{self._name((name + '_sum', key[1]))} {histogram.sum}")
+                lines.append(f"{self._name((name + '_count', key[1]))} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    def __init__(self, registry, host=METRICS_HOST, port=METRICS_PORT):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="clipvault-metrics", daemon=True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class TimedConnection(sqlite3.Connection):
+    metrics = None
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('clipvault_db_query_seconds', time.perf_counter() - start,
+                                     op=sql.split(None, 1)[0].upper())
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('clipvault_db_query_seconds', time.perf_counter() - start, op='COMMIT')
+
+class BKTree:
+    def __init__(self):
+        self.root = None
+        self.lock = threading.Lock()
+        self.size = 0
+
+    def add(self, key, value):
+        with self.lock:
+            if self.root is None:
+                self.root = (key, {value}, {})
+                self.size += 1
+                return
+            node = self.root
+            while True:
+                distance = hamming(key, node[0])
+                if distance == 0:
+                    node[1].add(value)
+                    return
+                child = node[2].get(distance)
+                if child is None:
+                    node[2][distance] = (key, {value}, {})
+                    self.size += 1
+                    return
+                node = child
+
+    def discard(self, key, value):
+        with self.lock:
+            node = self.root
+            while node is not None:
+                distance = hamming(key, node[0])
+                if distance == 0:
+                    node[1].discard(value)
+                    return
+                node = node[2].get(distance)
+
+    def search(self, key, radius):
+        found = []
+        with self.lock:
+            stack = [self.root] if self.root is not None else []
+            while stack:
+                node = stack.pop()
+                distance = hamming(key, node[0])
+                if distance <= radius:
+                    found.extend((distance, value) for value in node[1])
+                for edge, child in node[2].items():
+                    if distance - radius <= edge <= distance + radius:
+                        stack.append(child)
+        found.sort()
+        return found
+
+class FuzzyIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.text = bytearray()
+        self.starts = array('I')
+        self.ids = array('q')
+        self.pinned = bytearray()
+        self.slots = {}
+        self.keys = {}
+        self.dead = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def _keys(self, data):
+        words = FUZZY_WORD.findall(data)
+        keys = {word[:3] for word in words}
+        if len(words) > 1:
+            keys.add(b'^' + bytes(word[0] for word in words[:3]))
+        return keys
+
+    def add(self, id, text, pinned=False):
+        data = text.lower().replace('\n', ' ').encode('utf-8', errors='ignore')[:FUZZY_TEXT_LIMIT]
+        with self.lock:
+            self._remove(id)
+            self._append(id, data, bool(pinned))
+            self._compact()
+
+    def _append(self, id, data, pinned):
+        slot = len(self.ids)
+        self.starts.append(len(self.text))
+        self.text += data + b'\n'
+        self.ids.append(id)
+        self.pinned.append(pinned)
+        self.slots[id] = slot
+        for key in self._keys(data):
+            postings = self.keys.get(key)
+            if postings is None:
+                self.keys[key] = array('I', (slot,))
+            else:
+                postings.append(slot)
+
+    def remove(self, id):
+        with self.lock:
+            self._remove(id)
+            self._compact()
+
+    def _compact(self):
+        if self.dead > FUZZY_COMPACT_MIN and self.dead > len(self.slots):
+            live = [(self.ids[slot], self._record(slot), self.pinned[slot])
+                    for slot in sorted(self.slots.values())]
+            self.clear()
+            for args in live:
+                self._append(*args)
+
+    def _remove(self, id):
+        slot = self.slots.pop(id, None)
+        if slot is not None:
+            self.ids[slot] = -1
+            self.pinned[slot] = 0
+            self.dead += 1
+
+    def set_pinned(self, id, pinned):
+        with self.lock:
+            slot = self.slots.get(id)
+            if slot is not None:
+                self.pinned[slot] = bool(pinned)
+
+    def _record(self, slot):
+        end = self.starts[slot + 1] if slot + 1 < len(self.starts) else len(self.text)
+        return bytes(self.text[self.starts[slot]:end - 1])
+
+    def stats(self):
+        with self.lock:
+            postings = sum(len(postings) for postings in self.keys.values())
+            return {'clips': len(self.slots), 'keys': len(self.keys),
+                    'bytes': len(self.text) + self.starts.itemsize * len(self.starts) + 8 * len(self.ids)
+                    + len(self.pinned) + 4 * postings}
+
+    def _score(self, query, data):
+        position = data.find(query)
+        if position >= 0:
+            return 2.0 + (position == 0 or data[position - 1] in FUZZY_WORD_STARTS) - position / (len(data) + 1)
+        if b' ' not in query and query in bytes(word[0] for word in FUZZY_WORD.findall(data)):
+            return 1.5
+        score = 0.0
+        position = 0
+        previous = -2
+        for char in query:
+            found = data.find(char, position)
+            if found < 0:
+                return None
+            if found == previous + 1:
+                score += 2.0
+            if found == 0 or data[found - 1] in FUZZY_WORD_STARTS:
+                score += 1.5
+            position = found + 1
+            previous = found
+        return score / (len(query) * 2.0)
+
+    def _pattern(self, query):
+        parts = [re.escape(query[:1])]
+        for i in range(1, len(query)):
+            char = re.escape(query[i:i + 1])
+            parts.append(b'[^\\n' + char + b']*' + char)
+        return re.compile(b''.join(parts))
+
+    def search(self, query, limit=FUZZY_RESULTS):
+        query = b' '.join(query.lower().encode('utf-8', errors='ignore').split())[:FUZZY_TEXT_LIMIT]
+        with self.lock:
+            total = len(self.ids) or 1
+            if not query:
+                recent = []
+                for slot in range(len(self.ids) - 1, -1, -1):
+                    if self.ids[slot] >= 0:
+                        recent.append((FUZZY_PIN_BOOST * self.pinned[slot] + slot / total, self.ids[slot]))
+                        if len(recent) >= limit * 4:
+                            break
+                return [id for score, id in heapq.nlargest(limit, recent)]
+            words = FUZZY_WORD.findall(query)
+            keys = {word[:3] for word in words}
+            if len(words) == 1 and 2 <= len(query) <= 3:
+                keys.add(b'^' + query)
+            hits = Counter()
+            for key in sorted(keys, key=lambda key: len(self.keys.get(key, ()))):
+                hits.update(reversed(self.keys.get(key, array('I'))[-FUZZY_KEY_POSTINGS:]))
+            pool = dict(hits.most_common(FUZZY_CANDIDATES))
+            matches = deque(self._pattern(query).finditer(self.text, max(0, len(self.text) - FUZZY_SCAN_BYTES)),
+                            FUZZY_CANDIDATES)
+            for match in matches:
+                pool.setdefault(bisect.bisect_right(self.starts, match.start()) - 1, 0)
+            slot = self.pinned.find(1)
+            while slot >= 0 and len(pool) < FUZZY_CANDIDATES * 3:
+                pool.setdefault(slot, 0)
+                slot = self.pinned.find(1, slot + 1)
+            grams = [query[i:i + 3] for i in range(len(query) - 2)]
+            scored = []
+            for slot in pool:
+                id = self.ids[slot]
+                if id < 0:
+                    continue
+                data = self._record(slot)
+                score = self._score(query, data)
+                if score is None:
+                    shared = sum(gram in data for gram in grams)
+                    if not grams or shared * 2 < len(grams):
+                        continue
+                    score = 0.6 * shared / len(grams)
+                scored.append((score + FUZZY_RECENCY_WEIGHT * slot / total + FUZZY_PIN_BOOST * self.pinned[slot], id))
+            return [id for score, id in heapq.nlargest(limit, scored)]
+
+class DecompressingReader:
+    def __init__(self, source, codec, size):
+        self.source = source
+        self.codec = codec
+        self.size = size or 0
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def chunks(self, size=STREAM_CHUNK_SIZE):
+        return decompress_chunks(self.source.chunks(size), self.codec)
+
+    def read(self):
+        return b''.join(self.chunks())
+
+    def decode(self, encoding='utf-8', errors='replace'):
+        decoder = codecs.getincrementaldecoder(encoding)(errors)
+        parts = [decoder.decode(chunk) for chunk in self.chunks()]
+        parts.append(decoder.decode(b'', final=True))
+        return ''.join(parts)
+
+    def close(self):
+        self.source.close()
+
+class MappedContent:
+    def __init__(self, path, offset=0, length=None):
+        self.path = path
+        self._file = open(path, 'rb')
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0 if length is None else length + offset - start,
+                                   access=mmap.ACCESS_READ, offset=start)
+        except Exception:
+            self._file.close()
+            raise
+        self._base = memoryview(self._mmap)
+        self.view = self._base[offset - start:] if length is None else self._base[offset - start:offset - start + length]
+        self._pos = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def __bytes__(self):
+        return bytes(self.view)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.view is None
+
+    def release_pages(self):
+        if self.view is not None and hasattr(mmap, 'MADV_DONTNEED'):
+            self._mmap.madvise(mmap.MADV_DONTNEED)
+
+    def chunks(self, size=STREAM_CHUNK_SIZE):
+        for start in range(0, len(self.view), size):
+            yield self.view[start:start + size]
+
+    def decode(self, encoding='utf-8', errors='replace'):
+        return str(self.view, encoding, errors)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self._pos + size, len(self.view))
+        chunk = bytes(self.view[self._pos:end])
+        self._pos = end
+        return chunk
+
+    def readinto(self, buffer):
+        chunk = self.view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self._pos = max(0, min(offset, len(self.view)))
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        if getattr(self, 'view', None) is None:
+            return
+        self.view.release()
+        self._base.release()
+        self.view = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+class SegmentSpan:
+    def __init__(self, store):
+        self.store = store
+        self.path = store.name(store.active)
+        self.offset = store.tail
+        self.length = 0
+
+    def write(self, data):
+        self.store.file.write(data)
+        self.store.tail += len(data)
+        self.store.dirty = True
+        self.length += len(data)
+
+class SegmentStore:
+    def __init__(self, directory, metrics, root, max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.metrics = metrics
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.file = None
+        self.active = 1
+        self.tail = 0
+        self.dirty = False
+        self.missing = set()
+        self.mappings = weakref.WeakSet()
+        self.mappings_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.lock_file = open(os.path.join(directory, SEGMENT_LOCK), 'a+b')
+        self.instance_file = open(os.path.join(directory, INSTANCE_LOCK), 'a+b')
+
+    def path(self, number):
+        return os.path.join(self.directory, f"{number:08d}{SEGMENT_SUFFIX}")
+
+    def name(self, number):
+        return os.path.relpath(self.path(number), self.root)
+
+    def map(self, path, offset=0, length=None):
+        handle = MappedContent(path, offset, length)
+        with self.mappings_lock:
+            self.mappings.add(handle)
+        return handle
+
+    def release_mappings(self):
+        with self.mappings_lock:
+            handles = list(self.mappings)
+        released = 0
+        for handle in handles:
+            try:
+                handle.release_pages()
+                released += 1
+            except (ValueError, OSError):
+                continue
+        return released
+
+    def _referenced(self, db):
+        names = set()
+        row = db.execute("SELECT MIN(content) FROM blobs WHERE storage = 'segment'").fetchone()
+        while row[0] is not None:
+            names.add(row[0])
+            row = db.execute("SELECT MIN(content) FROM blobs WHERE storage = 'segment' AND content > ?",
+                             (row[0],)).fetchone()
+        return names
+
+    def numbers(self):
+        names = (name[:-len(SEGMENT_SUFFIX)] for name in os.listdir(self.directory)
+                 if name.endswith(SEGMENT_SUFFIX))
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def _flock(self, handle, operation):
+        if fcntl is not None:
+            fcntl.flock(handle.fileno(), operation)
+
+    def _sole_instance(self):
+        if fcntl is None:
+            return True
+        try:
+            fcntl.flock(self.instance_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            fcntl.flock(self.instance_file.fileno(), fcntl.LOCK_SH)
+            return False
+
+    @contextmanager
+    def _exclusive(self):
+        self._flock(self.lock_file, fcntl and fcntl.LOCK_EX)
+        try:
+            numbers = self.numbers()
+            if self.file is None or (numbers and numbers[-1] > self.active):
+                if self.file is not None:
+                    self._sync()
+                    self.file.close()
+                self.active = max(numbers[-1] if numbers else 1, self.active)
+                self._open()
+            self.tail = os.fstat(self.file.fileno()).st_size
+            yield
+        finally:
+            self._flock(self.lock_file, fcntl and fcntl.LOCK_UN)
+
+    def recover(self, db):
+        numbers = self.numbers()
+        self.active = numbers[-1] if numbers else 1
+        if not self._sole_instance():
+            return False
+        try:
+            self.missing = self._referenced(db) - {self.name(number) for number in numbers}
+            if self.missing:
+                raise FileNotFoundError(f"{len(self.missing)} segment(s) in the database, such as "
+                                        f"{min(self.missing)}, are not in {self.directory}; segments left untouched")
+            for number in numbers:
+                path = self.path(number)
+                tail = db.execute('''SELECT COALESCE(MAX(segment_offset + size), 0) FROM blobs 
+                                  WHERE storage = 'segment' AND content = ?''',
+                                  (self.name(number),)).fetchone()[0]
+                if not tail and number != numbers[-1]:
+                    os.remove(path)
+                elif os.path.getsize(path) > tail:
+                    self.metrics.inc('clipvault_segment_truncated_bytes_total', os.path.getsize(path) - tail)
+                    with open(path, 'r+b') as f:
+                        f.truncate(tail)
+        finally:
+            self._flock(self.instance_file, fcntl and fcntl.LOCK_SH)
+        return True
+
+    def append(self, data):
+        with self.lock, self._exclusive():
+            if self.tail and self.tail + len(data) > self.max_bytes:
+                self._roll()
+            offset = self.tail
+            self.file.seek(offset)
+            self.file.write(data)
+            self.tail += len(data)
+            self.dirty = True
+            return self.name(self.active), offset
+
+    @contextmanager
+    def stream(self, estimate=0):
+        with self.lock, self._exclusive():
+            if self.tail and self.tail + estimate > self.max_bytes:
+                self._roll()
+            self.file.seek(self.tail)
+            yield SegmentSpan(self)
+
+    def _roll(self):
+        self._sync()
+        self.file.close()
+        self.active += 1
+        self._open()
+
+    def _open(self):
+        path = self.path(self.active)
+        open(path, 'ab').close()
+        self.file = open(path, 'r+b', buffering=0)
+        self.tail = os.path.getsize(path)
+
+    def sync(self):
+        with self.lock:
+            self._sync()
+
+    def _sync(self):
+        if not self.dirty:
+            return
+        with self.metrics.timed('clipvault_segment_fsync_seconds'):
+            os.fsync(self.file.fileno())
+        self.dirty = False
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self._sync()
+                self.file.close()
+                self.file = None
+            self.lock_file.close()
+            self.instance_file.close()
+
+    def is_sealed(self, number):
+        numbers = self.numbers()
+        if not numbers or number >= numbers[-1]:
+            return False
+        return time.time() - os.path.getmtime(self.path(number)) >= ORPHAN_GRACE_SECONDS
+
+    @contextmanager
+    def maintenance(self, blocking=True):
+        with open(os.path.join(self.directory, MAINTENANCE_LOCK), 'a+b') as handle:
+            try:
+                self._flock(handle, fcntl and (fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB))
+            except OSError:
+                yield False
+                return
+            yield True
+
+    def compact(self, db, ratio=SEGMENT_COMPACT_RATIO):
+        live = dict(db.execute('''SELECT content, SUM(size) FROM blobs 
+                               WHERE storage = 'segment' GROUP BY content''').fetchall())
+        compacted = 0
+        for number in self.numbers():
+            path, name = self.path(number), self.name(number)
+            if not self.is_sealed(number):
+                continue
+            size = os.path.getsize(path)
+            if size and live.get(name, 0) >= size * ratio:
+                continue
+            rows = db.execute('''SELECT hash, segment_offset, size FROM blobs 
+                              WHERE storage = 'segment' AND content = ?''', (name,)).fetchall()
+            moved = []
+            for digest, offset, length in rows:
+                with MappedContent(path, offset, length) as handle:
+                    moved.append(self.append(handle.view) + (digest,))
+            self.sync()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for new_path, new_offset, digest in moved:
+                    db.execute('''UPDATE blobs SET content = ?, segment_offset = ? 
+                               WHERE hash = ? AND storage = 'segment' AND content = ?''',
+                               (new_path, new_offset, digest, name))
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+            os.remove(path)
+            compacted += 1
+            self.metrics.inc('clipvault_segment_compactions_total')
+            self.metrics.inc('clipvault_segment_reclaimed_bytes_total', size - live.get(name, 0))
+        return compacted
+
+    def stats(self):
+        sizes = [os.path.getsize(self.path(number)) for number in self.numbers()]
+        return {'segments': len(sizes), 'bytes': sum(sizes)}
+
+class ContentCache:
+    def __init__(self, budget_bytes, weights=CACHE_TYPE_WEIGHTS):
+        self.weights = dict(weights)
+        self.segments = {ctype: OrderedDict() for ctype in self.weights}
+        self.type_bytes = {ctype: 0 for ctype in self.weights}
+        self.index = {}
+        self.origins = {}
+        self.lock = threading.RLock()
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejections = 0
+        self.set_budget(budget_bytes)
+
+    def set_budget(self, budget_bytes):
+        with self.lock:
+            self.budget = budget_bytes
+            for ctype in self.segments:
+                self._evict(ctype)
+
+    def type_budget(self, ctype):
+        return int(self.budget * self.weights.get(ctype, 0))
+
+    def has_room(self, ctype, size):
+        with self.lock:
+            budget = self.type_budget(ctype)
+            return (ctype in self.segments and size <= budget * CACHE_MAX_ITEM_FRACTION
+                    and self.type_bytes[ctype] + size <= budget)
+
+    def get(self, id):
+        with self.lock:
+            ctype = self.index.get(id)
+            if ctype is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            segment = self.segments[ctype]
+            segment.move_to_end(id)
+            return segment[id]
+
+    def put(self, id, content, ctype, origin=None, epoch=None):
+        size = len(content)
+        with self.lock:
+            if epoch is not None and epoch != self.epoch:
+                return False
+            if ctype not in self.segments or size > self.type_budget(ctype) * CACHE_MAX_ITEM_FRACTION:
+                self.rejections += 1
+                return False
+            self._remove(id)
+            self.segments[ctype][id] = content
+            self.type_bytes[ctype] += size
+            self.index[id] = ctype
+            self.origins[id] = origin
+            self._evict(ctype)
+            return True
+
+    def pop(self, id):
+        with self.lock:
+            self.epoch += 1
+            return self._remove(id)
+
+    def _remove(self, id):
+        ctype = self.index.pop(id, None)
+        if ctype is None:
+            return None
+        self.origins.pop(id, None)
+        content = self.segments[ctype].pop(id)
+        self.type_bytes[ctype] -= len(content)
+        return content
+
+    def shrink(self, fraction):
+        with self.lock:
+            for ctype in self.segments:
+                self._evict(ctype, int(self.type_budget(ctype) * fraction))
+
+    def _evict(self, ctype, limit=None):
+        segment = self.segments[ctype]
+        limit = self.type_budget(ctype) if limit is None else limit
+        while segment and self.type_bytes[ctype] > limit:
+            id, content = segment.popitem(last=False)
+            del self.index[id]
+            self.origins.pop(id, None)
+            self.type_bytes[ctype] -= len(content)
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            for ctype, segment in self.segments.items():
+                segment.clear()
+                self.type_bytes[ctype] = 0
+            self.index.clear()
+            self.origins.clear()
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def total_bytes(self):
+        return sum(self.type_bytes.values())
+
+    def stats(self):
+        with self.lock:
+            return self._stats()
+
+    def _stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'rejections': self.rejections,
+            'items': len(self.index),
+            'bytes': self.total_bytes(),
+            'budget': self.budget,
+        }
+
+class Prefetcher:
+    def __init__(self, vault):
+        self.vault = vault
+        self.queue = queue.Queue()
+        self.warmed = set()
+        self.loaded = 0
+        self.hits = 0
+        self.thread = threading.Thread(target=self._run, name="clipvault-prefetch", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def request(self, ids, reason):
+        ids = [id for id in ids if id is not None and id not in self.vault.cache]
+        if ids:
+            self.queue.put((ids, reason))
+
+    def record_hit(self, id):
+        if id in self.warmed:
+            self.warmed.discard(id)
+            self.hits += 1
+            self.vault.metrics.inc('clipvault_prefetch_hits_total')
+
+    def stop(self):
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def _run(self):
+        db = self.vault.connect()
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            ids, reason = item
+            for id in ids:
+                try:
+                    self._warm(db, id, reason)
+                except Exception:
+                    pass
+        db.close()
+
+    def _warm(self, db, id, reason):
+        cache = self.vault.cache
+        if id in cache:
+            return
+        row = self.vault._blob_row(db, id)
+        if not row:
+            return
+        ctype, stored, storage, codec, raw_size, offset, size = row
+        if storage == 'reference' or not cache.has_room(ctype, raw_size or size):
+            self.vault.metrics.inc('clipvault_prefetch_skipped_total', reason='budget')
+            return
+        epoch = cache.epoch
+        content = self.vault._read_blob(stored, storage, codec, raw_size, False, offset, size)
+        if cache.put(id, content, ctype, storage, epoch):
+            self.warmed.add(id)
+            self.loaded += 1
+            self.vault.metrics.inc('clipvault_prefetch_loaded_total', reason=reason)
+            self.vault.metrics.inc('clipvault_prefetch_bytes_total', len(content))
+
+    def stats(self):
+        return {'loaded': self.loaded, 'hits': self.hits}
+
+class SearchWorker(QObject):
+    results_ready = pyqtSignal(int, int, list, bool)
+
+    def __init__(self, vault):
+        super().__init__()
+        self.vault = vault
+        self.db = None
+
+    @pyqtSlot(int, str, int)
+    def run_query(self, generation, query, offset):
+        try:
+            if self.db is None:
+                self.db = self.vault.connect()
+            rows = self.vault.search(query, SEARCH_PAGE_SIZE + 1, offset, db=self.db)
+        except Exception:
+            rows = []
+        has_more = len(rows) > SEARCH_PAGE_SIZE
+        self.results_ready.emit(generation, offset, rows[:SEARCH_PAGE_SIZE], has_more)
+
+class IngestPipeline(QObject):
+    stored = pyqtSignal(int)
+    dropped = pyqtSignal()
+
+    def __init__(self, vault):
+        super().__init__()
+        self.vault = vault
+        self.queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+        self.dropped_count = 0
+        self.traces = {}
+        self.thread = threading.Thread(target=self._run, name="clipvault-ingest", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, payload, ctype, trace=None):
+        try:
+            self.queue.put((payload, ctype, trace), timeout=INGEST_PUT_TIMEOUT)
+            return True
+        except queue.Full:
+            self.dropped_count += 1
+            self.vault.metrics.inc('clipvault_ingest_dropped_total')
+            self.dropped.emit()
+            return False
+
+    def stop(self):
+        if not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=INGEST_PUT_TIMEOUT)
+        except queue.Full:
+            return
+        self.thread.join(timeout=5)
+
+    def _run(self):
+        db = self.vault.connect()
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while len(batch) < INGEST_BATCH_SIZE and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                running = False
+            stored = self._store_batch(db, batch)
+            for id, trace in stored:
+                self.traces[id] = trace
+                self.stored.emit(id)
+        db.close()
+
+    def _store_batch(self, db, batch):
+        stored = []
+        if not batch:
+            return stored
+        prepared = []
+        for payload, ctype, trace in batch:
+            trace = trace or ClipTrace(ctype)
+            trace.mark('queue')
+            try:
+                prepared.append((payload, ctype, trace, self.vault._prepare(db, payload, ctype, trace)))
+            except Exception:
+                self.vault.metrics.inc('clipvault_ingest_failed_total')
+        self.vault.segments.sync()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            for payload, ctype, trace, item in prepared:
+                db.execute("SAVEPOINT ingest_item")
+                try:
+                    id, preview = self.vault._persist(db, payload, ctype, trace, item)
+                    db.execute("RELEASE ingest_item")
+                    stored.append((id, trace))
+                except Exception:
+                    db.execute("ROLLBACK TO ingest_item")
+                    db.execute("RELEASE ingest_item")
+                    self.vault.metrics.inc('clipvault_ingest_failed_total')
+            self.vault.segments.sync()
+            db.commit()
+        except Exception:
+            db.rollback()
+            self.vault.metrics.inc('clipvault_ingest_failed_total', len(prepared))
+            return []
+        for id, trace in stored:
+            trace.mark('commit')
+        return stored
+
+class MemoryGovernor:
+    def __init__(self, vault, ceiling_bytes):
+        self.vault = vault
+        self.ceiling = ceiling_bytes
+        self.skip = 0
+        self.backoff = 1
+        self.actions = 0
+
+    def check(self, rss):
+        if rss is None or rss <= self.ceiling:
+            self.skip = 0
+            self.backoff = 1
+            return
+        if self.skip:
+            self.skip -= 1
+            return
+        for stage in GOVERNOR_STAGES:
+            try:
+                getattr(self, f"_release_{stage}")()
+            except Exception:
+                continue
+            after = self.vault._rss()
+            self.actions += 1
+            self.vault.metrics.inc('clipvault_governor_actions_total', stage=stage)
+            self.vault.metrics.write({'event': 'memory_governor', 'stage': stage, 'rss_before': rss,
+                                      'rss_after': after, 'ceiling': self.ceiling})
+            rss = after
+            if rss <= self.ceiling:
+                self.backoff = 1
+                return
+        self.skip = self.backoff
+        self.backoff = min(self.backoff * 2, GOVERNOR_MAX_BACKOFF)
+
+    def _release_cache(self):
+        self.vault.cache.shrink(GOVERNOR_CACHE_FRACTION)
+
+    def _release_pixmaps(self):
+        QPixmapCache.clear()
+
+    def _release_mappings(self):
+        gc.collect()
+        self.vault.segments.release_mappings()
+
+    def _release_sqlite(self):
+        self.vault.db.execute("PRAGMA shrink_memory")
+
+    def _release_malloc(self):
+        ctypes.CDLL(None).malloc_trim(0)
+
+class RetentionEngine(QObject):
+    swept = pyqtSignal(int)
+    finished = pyqtSignal(list)
+
+    def __init__(self, vault, policy=None):
+        super().__init__()
+        self.vault = vault
+        self.policy = dict(RETENTION_DEFAULTS)
+        self.policy['type_quotas'] = dict(RETENTION_DEFAULTS['type_quotas'])
+        self.policy.update(policy or {})
+        self.total_deleted = 0
+        self.recompressed = 0
+        self._scan = None
+        self._blob_thread = None
+        self._sweep_thread = None
+        self.finished.connect(self._on_swept, Qt.QueuedConnection)
+        self.timer = QTimer(self)
+        self.timer.setInterval(RETENTION_INTERVAL_MS)
+        self.timer.timeout.connect(self.start_sweep)
+
+    def start(self):
+        self.timer.start()
+        QTimer.singleShot(0, self.start_sweep)
+
+    def stop(self):
+        self.timer.stop()
+        if self._sweep_thread is not None:
+            self._sweep_thread.join(timeout=5)
+        if self._scan is not None:
+            self._scan.close()
+            self._scan = None
+
+    def start_sweep(self):
+        if self._sweep_thread and self._sweep_thread.is_alive():
+            return
+        self._sweep_thread = threading.Thread(target=self.sweep, name="clipvault-retention", daemon=True)
+        self._sweep_thread.start()
+
+    def sweep(self):
+        db = self.vault.connect()
+        budget = RETENTION_BATCH
+        removed = []
+        start = time.perf_counter()
+        try:
+            removed += self._expire(db, budget)
+            removed += self._enforce_count(db, budget - len(removed))
+            for ctype, quota in self.policy['type_quotas'].items():
+                removed += self._enforce_bytes(db, budget - len(removed), quota, ctype)
+            removed += self._enforce_bytes(db, budget - len(removed), self.policy['max_total_bytes'])
+            db.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?", (CHANGES_KEEP,))
+            db.commit()
+            self.finished.emit(removed)
+            self.vault._flush_unlinks(db)
+            self._scan_orphans(db)
+            self._start_blob_maintenance()
+        except Exception:
+            db.rollback()
+            self.vault.metrics.inc('clipvault_retention_errors_total')
+            return 0
+        finally:
+            db.close()
+        deleted = len(removed)
+        self.vault.metrics.observe('clipvault_retention_sweep_seconds', time.perf_counter() - start)
+        self.vault.metrics.inc('clipvault_retention_deleted_total', deleted)
+        self.total_deleted += deleted
+        return deleted
+
+    def _on_swept(self, removed):
+        self.vault._announce_removed(removed)
+        self.vault.prefetch_frequent()
+        if removed:
+            self.vault.load_history()
+            self.swept.emit(len(removed))
+        if len(removed) >= RETENTION_BATCH:
+            self.start_sweep()
+
+    def _expire(self, db, limit):
+        hours = self.policy['max_age_hours']
+        if not hours or limit <= 0:
+            return []
+        return self.vault._delete_clips(db, '''id IN (SELECT id FROM clips WHERE pinned = 0 
+                                        AND created < datetime('now', ?) 
+                                        ORDER BY created, id LIMIT ?)''', (f"-{hours} hours", limit))
+
+    def _enforce_count(self, db, limit):
+        max_items = self.policy['max_items']
+        if not max_items or limit <= 0:
+            return []
+        excess = db.execute("SELECT COUNT(*) FROM clips").fetchone()[0] - max_items
+        if excess <= 0:
+            return []
+        return self.vault._delete_clips(db, '''id IN (SELECT id FROM clips WHERE pinned = 0 
+                                        ORDER BY created, id LIMIT ?)''', (min(excess, limit),))
+
+    def _enforce_bytes(self, db, limit, quota, ctype=None):
+        if not quota or limit <= 0:
+            return []
+        type_filter = " AND type = ?" if ctype else ""
+        params = (ctype,) if ctype else ()
+        total = db.execute(f"SELECT COALESCE(SUM(size), 0) FROM clips WHERE 1{type_filter}", params).fetchone()[0]
+        excess = total - quota
+        if excess <= 0:
+            return []
+        ids = []
+        cursor = db.execute(f'''SELECT id, size FROM clips WHERE pinned = 0{type_filter} 
+                            ORDER BY created, id LIMIT ?''', params + (limit,))
+        for id, size in cursor.fetchall():
+            if excess <= 0:
+                break
+            ids.append(id)
+            excess -= size or 0
+        if not ids:
+            return []
+        return self.vault._delete_clips(db, f"id IN ({','.join('?' * len(ids))})", tuple(ids))
+
+    def _start_blob_maintenance(self):
+        if self._blob_thread and self._blob_thread.is_alive():
+            return
+        self._blob_thread = threading.Thread(target=self._maintain_blobs,
+                                             name="clipvault-blobs", daemon=True)
+        self._blob_thread.start()
+
+    def _maintain_blobs(self):
+        db = self.vault.connect()
+        try:
+            with self.vault.segments.maintenance(blocking=False) as acquired:
+                if not acquired:
+                    return
+                if self.policy['recompress_cold_hours']:
+                    self._recompress_cold(db)
+                self.vault._reclaim_unreferenced(db)
+                self.vault._migrate_legacy_files(db)
+                self.vault._backfill_thumbnails(db)
+                with self.vault.metrics.timed('clipvault_segment_compaction_seconds'):
+                    self.vault.segments.compact(db)
+        except Exception:
+            db.rollback()
+        finally:
+            db.close()
+
+    def _recompress_cold(self, db):
+        codecs = tuple(CODECS)
+        cursor = db.execute(f'''SELECT hash FROM blobs b WHERE cold = 0 
+                            AND codec IN ({", ".join("?" * len(codecs))}) 
+                            AND NOT EXISTS (SELECT 1 FROM clips c WHERE c.hash = b.hash 
+                                            AND c.created > datetime('now', ?)) 
+                            LIMIT ?''', codecs + (f"-{self.policy['recompress_cold_hours']} hours",
+                                                  COLD_RECOMPRESS_BATCH))
+        for (digest,) in cursor.fetchall():
+            self.vault._recompress_blob(db, digest)
+            self.recompressed += 1
+            self.vault.metrics.inc('clipvault_retention_recompressed_total')
+
+    def _scan_orphans(self, db):
+        if self._scan is None:
+            self._scan = os.scandir(self.vault.data_dir)
+        now = time.time()
+        for _ in range(ORPHAN_SCAN_BATCH):
+            entry = next(self._scan, None)
+            if entry is None:
+                self._scan.close()
+                self._scan = None
+                return
+            try:
+                if not entry.is_file() or now - entry.stat().st_mtime < ORPHAN_GRACE_SECONDS:
+                    continue
+                path = self.vault.relative(entry.path)
+                if not entry.name.endswith('.tmp') and self.vault._is_referenced(db, path):
+                    continue
+                os.unlink(entry.path)
+                self.vault.metrics.inc('clipvault_retention_orphans_removed_total')
+            except OSError:
+                pass
+
+class VaultArchive:
+    def __init__(self, vault, progress=None):
+        self.vault = vault
+        self.progress = progress
+        self.reported = 0
+
+    def _report(self, done, total, force=False):
+        now = time.monotonic()
+        if self.progress is not None and (force or now - self.reported >= ARCHIVE_PROGRESS_SECONDS):
+            self.reported = now
+            self.progress(done, total)
+
+    def _frame(self, out, kind, meta, length=0):
+        meta = json.dumps(meta).encode('utf-8')
+        out.write(ARCHIVE_FRAME.pack(kind, len(meta), length))
+        out.write(meta)
+
+    def export(self, db, path):
+        counts = {'blobs': 0, 'clips': 0, 'missing': 0, 'bytes': 0}
+        with self.vault.segments.maintenance(), open(path + '.tmp', 'wb') as out:
+            db.execute("BEGIN")
+            try:
+                blobs, clips = db.execute('''SELECT (SELECT COUNT(*) FROM blobs WHERE refs > 0), 
+                                          (SELECT COUNT(*) FROM clips)''').fetchone()
+                out.write(ARCHIVE_MAGIC)
+                self._frame(out, b'H', {'version': ARCHIVE_VERSION, 'blobs': blobs, 'clips': clips})
+                cursor = db.execute('''SELECT hash, content, storage, codec, raw_size, segment_offset, size 
+                                    FROM blobs WHERE refs > 0''')
+                for digest, stored, storage, codec, raw_size, offset, size in cursor:
+                    meta = {'hash': digest, 'codec': codec, 'raw_size': raw_size}
+                    if storage == 'reference':
+                        meta['reference'] = True
+                    try:
+                        with self.vault._stored_view(stored, storage, offset, size) as view:
+                            self._frame(out, b'B', meta, len(view))
+                            for chunk in iter_chunks(view):
+                                out.write(chunk)
+                            counts['bytes'] += len(view)
+                        counts['blobs'] += 1
+                    except (OSError, ValueError):
+                        counts['missing'] += 1
+                    self._report(counts['blobs'] + counts['missing'], blobs + clips)
+                cursor = db.execute('''SELECT hash, type, preview, created, pinned, pastes, size 
+                                    FROM clips ORDER BY created, id''')
+                for digest, ctype, preview, created, pinned, pastes, size in cursor:
+                    self._frame(out, b'C', {'hash': digest, 'type': ctype, 'preview': preview,
+                                            'created': created, 'pinned': bool(pinned),
+                                            'pastes': pastes or 0, 'size': size})
+                    counts['clips'] += 1
+                    self._report(blobs + counts['clips'], blobs + clips)
+                self._frame(out, b'E', counts)
+            finally:
+                db.rollback()
+        os.replace(path + '.tmp', path)
+        self._report(blobs + clips, blobs + clips, True)
+        return counts
+
+    def import_archive(self, db, path):
+        counts = {'blobs': 0, 'clips': 0, 'duplicates': 0, 'skipped': 0}
+        total = os.path.getsize(path)
+        with self.vault.segments.maintenance(), open(path, 'rb') as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a ClipVault archive")
+            pending = pending_bytes = 0
+            try:
+                while True:
+                    header = f.read(ARCHIVE_FRAME.size)
+                    if len(header) < ARCHIVE_FRAME.size:
+                        raise ValueError(f"{path} is truncated")
+                    kind, meta_length, length = ARCHIVE_FRAME.unpack(header)
+                    meta = json.loads(self._read_exact(f, meta_length))
+                    if kind == b'E':
+                        break
+                    if not db.in_transaction:
+                        db.execute("BEGIN IMMEDIATE")
+                    if kind == b'B':
+                        self._import_blob(db, f, meta, length, counts)
+                    elif kind == b'C':
+                        self._import_clip(db, meta, counts)
+                    else:
+                        f.seek(length, os.SEEK_CUR)
+                    pending += 1
+                    pending_bytes += length
+                    if pending >= ARCHIVE_BATCH or pending_bytes >= ARCHIVE_BATCH_BYTES:
+                        self._commit(db)
+                        pending = pending_bytes = 0
+                    self._report(f.tell(), total)
+                self._commit(db)
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                self.vault._reclaim_unreferenced(db)
+        self._report(total, total, True)
+        return counts
+
+    def _commit(self, db):
+        self.vault.segments.sync()
+        db.commit()
+
+    def _read_exact(self, f, length):
+        data = f.read(length)
+        if len(data) < length:
+            raise ValueError("archive is truncated")
+        return data
+
+    def _import_blob(self, db, f, meta, length, counts):
+        digest = meta['hash']
+        if db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+            f.seek(length, os.SEEK_CUR)
+            return
+        if meta.get('reference'):
+            f.seek(length, os.SEEK_CUR)
+            db.execute('''INSERT INTO blobs (hash, content, storage, size, refs, codec, raw_size) 
+                       VALUES (?, NULL, 'reference', 0, 0, NULL, ?)''', (digest, meta.get('raw_size')))
+        elif length > SEGMENT_THRESHOLD:
+            with self.vault.segments.stream(length) as span:
+                remaining = length
+                while remaining:
+                    chunk = self._read_exact(f, min(STREAM_CHUNK_SIZE, remaining))
+                    span.write(chunk)
+                    remaining -= len(chunk)
+            db.execute('''INSERT INTO blobs (hash, content, storage, size, refs, codec, raw_size, segment_offset) 
+                       VALUES (?, ?, 'segment', ?, 0, ?, ?, ?)''',
+                       (digest, span.path, span.length, meta.get('codec'), meta.get('raw_size'), span.offset))
+        else:
+            db.execute('''INSERT INTO blobs (hash, content, storage, size, refs, codec, raw_size) 
+                       VALUES (?, ?, 'db', ?, 0, ?, ?)''',
+                       (digest, self._read_exact(f, length), length, meta.get('codec'), meta.get('raw_size')))
+        counts['blobs'] += 1
+
+    def _import_clip(self, db, meta, counts):
+        digest, ctype = meta['hash'], meta['type']
+        if not db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+            counts['skipped'] += 1
+            return
+        existing = db.execute("SELECT id FROM clips WHERE hash=? AND type=?", (digest, ctype)).fetchone()
+        if existing:
+            if meta.get('pinned'):
+                db.execute("UPDATE clips SET pinned = 1 WHERE id=? AND pinned = 0", (existing[0],))
+            counts['duplicates'] += 1
+            return
+        cursor = db.execute('''INSERT INTO clips (hash, preview, type, size, created, pinned, pastes) 
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                            (digest, meta.get('preview'), ctype, meta.get('size'), meta.get('created'),
+                             int(bool(meta.get('pinned'))), meta.get('pastes') or 0))
+        db.execute("UPDATE blobs SET refs = refs + 1 WHERE hash=?", (digest,))
+        content = self.vault._blob_head(db, digest, SEARCH_INDEX_LIMIT) if ctype in ('text', 'file') else None
+        self.vault._index_content(db, cursor.lastrowid, content or meta.get('preview') or "", ctype,
+                                  meta.get('preview'))
+        counts['clips'] += 1
+
+class IpcServer(QObject):
+    command = pyqtSignal(str, int, object)
+
+    def __init__(self, vault, path=IPC_SOCKET):
+        super().__init__()
+        self.vault = vault
+        self.path = path
+        self._claim(path)
+        ipc = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                db = ipc.vault.connect()
+                try:
+                    for line in self.rfile:
+                        if not line.strip():
+                            continue
+                        try:
+                            ipc.dispatch(db, json.loads(line), self.wfile)
+                        except (BrokenPipeError, ConnectionResetError):
+                            return
+                        except Exception as e:
+                            ipc._send(self.wfile, {'ok': False, 'error': str(e)})
+                finally:
+                    db.close()
+
+        umask = os.umask(0o177)
+        try:
+            self.server = socketserver.ThreadingUnixStreamServer(path, Handler)
+        finally:
+            os.umask(umask)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="clipvault-ipc", daemon=True)
+        self.thread.start()
+
+    def _claim(self, path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            if os.path.exists(path):
+                os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise OSError(f"{path} is served by another ClipVault")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _send(self, out, message):
+        out.write(json.dumps(message).encode('utf-8') + b'\n')
+
+    def _send_rows(self, out, rows):
+        if rows:
+            out.write(b''.join(json.dumps({
+                'id': row[0], 'preview': row[1], 'type': row[2], 'pinned': bool(row[3]),
+                'created': row[4] if len(row) > 4 else None,
+            }).encode('utf-8') + b'\n' for row in rows))
+
+    def dispatch(self, db, request, out):
+        op = request.get('op')
+        with self.vault.metrics.timed('clipvault_ipc_seconds', op=str(op)):
+            if op == 'list':
+                self._list(db, request, out)
+            elif op == 'search':
+                self._search(db, request, out)
+            elif op == 'fuzzy':
+                self._fuzzy(db, request, out)
+            elif op == 'quickpick':
+                self._command(op, dict(request, id=0), out)
+            elif op == 'get':
+                self._get(db, request, out)
+            elif op in IPC_COMMANDS:
+                self._command(op, request, out)
+            elif op in IPC_TRANSFERS:
+                self._transfer(db, op, request, out)
+            else:
+                raise ValueError(f"unknown op {op!r}")
+
+    def _list(self, db, request, out):
+        limit = request.get('limit')
+        before = request.get('before')
+        pinned_only = bool(request.get('pinned'))
+        sent = 0
+        while limit is None or sent < limit:
+            page = HISTORY_PAGE_SIZE if limit is None else min(HISTORY_PAGE_SIZE, limit - sent)
+            rows = self.vault.fetch_page(tuple(before) if before else None, page, pinned_only, db=db)
+            self._send_rows(out, rows)
+            sent += len(rows)
+            if len(rows) < page:
+                before = None
+                break
+            before = [rows[-1][4], rows[-1][0]]
+        self._send(out, {'ok': True, 'done': True, 'count': sent, 'next': before})
+
+    def _search(self, db, request, out):
+        limit = int(request.get('limit') or SEARCH_PAGE_SIZE)
+        offset = int(request.get('offset') or 0)
+        rows = self.vault.search(str(request.get('query', '')), limit + 1, offset, db=db)
+        self._send_rows(out, rows[:limit])
+        has_more = len(rows) > limit
+        self._send(out, {'ok': True, 'done': True, 'count': len(rows[:limit]),
+                         'next': offset + limit if has_more else None})
+
+    def _fuzzy(self, db, request, out):
+        limit = int(request.get('limit') or FUZZY_RESULTS)
+        rows = self.vault.fuzzy_search(str(request.get('query', '')), limit, db=db)
+        self._send_rows(out, rows)
+        self._send(out, {'ok': True, 'done': True, 'count': len(rows)})
+
+    def _get(self, db, request, out):
+        id = int(request['id'])
+        row = self.vault._blob_row(db, id)
+        if not row:
+            raise LookupError(f"no clip {id}")
+        ctype, stored, storage, codec, raw_size, offset, size = row
+        content = self.vault._read_blob(stored, storage, codec, raw_size, True, offset, size)
+        if content is None:
+            raise LookupError(f"content of clip {id} was not stored")
+        try:
+            self._send(out, {'ok': True, 'id': id, 'type': ctype, 'size': len(content)})
+            if isinstance(content, bytes):
+                out.write(content)
+            else:
+                for chunk in content.chunks():
+                    out.write(chunk)
+        finally:
+            if not isinstance(content, bytes):
+                content.close()
+
+    def _transfer(self, db, op, request, out):
+        archive = VaultArchive(self.vault, lambda done, total: self._send(out, {'progress': done, 'total': total}))
+        path = str(request['path'])
+        try:
+            counts = archive.export(db, path) if op == 'export' else archive.import_archive(db, path)
+        except Exception as e:
+            self.vault.events.transfer_finished.emit(op, f"failed: {e}")
+            raise
+        self.vault.events.transfer_finished.emit(op, ", ".join(f"{value} {name}" for name, value in counts.items()))
+        self._send(out, dict(counts, ok=True, done=True))
+
+    def _command(self, op, request, out):
+        id = int(request['id'])
+        reply = queue.Queue(maxsize=1)
+        self.command.emit(op, id, reply)
+        try:
+            ok = reply.get(timeout=IPC_REPLY_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"{op} timed out")
+        self._send(out, {'ok': ok, 'id': id} if ok else {'ok': False, 'id': id, 'error': f"no clip {id}"})
+
+class VaultEvents(QObject):
+    clip_added = pyqtSignal(int)
+    clip_removed = pyqtSignal(int)
+    clip_changed = pyqtSignal(int)
+    history_reset = pyqtSignal()
+    transfer_progress = pyqtSignal(str, int, int)
+    transfer_finished = pyqtSignal(str, str)
+
+class ClipListModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.by_id = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return None
+        id, preview, ctype, pinned, created = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{'📌 ' if pinned else ''}{preview} ({ctype})"
+        if role == Qt.DecorationRole and ctype == 'image':
+            return self.vault.thumbnail(id)
+        if role == Qt.SizeHintRole:
+            return QSize(0, THUMBNAIL_VIEW_SIZE + 4)
+        if role == Qt.UserRole:
+            return id
+        if role == Qt.UserRole + 1:
+            return "pinned" if pinned else None
+        return None
+
+    def row_of(self, id):
+        row = self.by_id.get(id)
+        return -1 if row is None else self._locate(row)
+
+    def _locate(self, row):
+        return self.rows.index(row)
+
+    def reset_rows(self, rows):
+        self.beginResetModel()
+        self.rows = [self._row(row) for row in rows]
+        self.by_id = {row[0]: row for row in self.rows}
+        self.endResetModel()
+
+    def append_rows(self, rows):
+        if not rows:
+            return
+        start = len(self.rows)
+        self.beginInsertRows(QModelIndex(), start, start + len(rows) - 1)
+        rows = [self._row(row) for row in rows]
+        self.rows.extend(rows)
+        self.by_id.update((row[0], row) for row in rows)
+        self.endInsertRows()
+
+    def insert_row(self, position, row):
+        self.beginInsertRows(QModelIndex(), position, position)
+        row = self._row(row)
+        self.rows.insert(position, row)
+        self.by_id[row[0]] = row
+        self.endInsertRows()
+
+    def remove_id(self, id):
+        position = self.row_of(id)
+        if position < 0:
+            return
+        self.beginRemoveRows(QModelIndex(), position, position)
+        del self.rows[position]
+        del self.by_id[id]
+        self.endRemoveRows()
+
+    def update_row(self, row):
+        position = self.row_of(row[0])
+        if position < 0:
+            return
+        self.rows[position] = self.by_id[row[0]] = self._row(row)
+        index = self.index(position)
+        self.dataChanged.emit(index, index)
+
+    def _row(self, row):
+        id, preview, ctype, pinned = row[:4]
+        return (id, preview, ctype, bool(pinned), row[4] if len(row) > 4 else None)
+
+    def on_clip_removed(self, id):
+        self.remove_id(id)
+
+class HistoryModel(ClipListModel):
+    def __init__(self, vault, pinned_only=False, parent=None):
+        super().__init__(parent)
+        self.vault = vault
+        self.pinned_only = pinned_only
+        self.exhausted = False
+        vault.events.clip_added.connect(self.on_clip_added)
+        vault.events.clip_removed.connect(self.on_clip_removed)
+        vault.events.clip_changed.connect(self.on_clip_changed)
+        vault.events.history_reset.connect(self.reload)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted:
+            return
+        before = (self.rows[-1][4], self.rows[-1][0]) if self.rows else None
+        with self.vault.metrics.timed('clipvault_ui_refresh_seconds', view='pinned' if self.pinned_only else 'history'):
+            rows = self.vault.fetch_page(before, HISTORY_PAGE_SIZE, self.pinned_only)
+            self.exhausted = len(rows) < HISTORY_PAGE_SIZE
+            self.append_rows(rows)
+
+    def reload(self):
+        self.beginResetModel()
+        self.rows = []
+        self.by_id = {}
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def _bisect(self, key):
+        low, high = 0, len(self.rows)
+        while low < high:
+            middle = (low + high) // 2
+            if (self.rows[middle][4], self.rows[middle][0]) > key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _locate(self, row):
+        position = self._bisect((row[4], row[0]))
+        if position < len(self.rows) and self.rows[position][0] == row[0]:
+            return position
+        return super()._locate(row)
+
+    def _position_for(self, row):
+        position = self._bisect((row[4], row[0]))
+        return position if position < len(self.rows) or self.exhausted else -1
+
+    def _place(self, row):
+        self.remove_id(row[0])
+        if self.pinned_only and not row[3]:
+            return
+        position = self._position_for(row)
+        if position >= 0:
+            self.insert_row(position, row)
+
+    def on_clip_added(self, id):
+        row = self.vault.get_row(id)
+        if row:
+            self._place(row)
+
+    def on_clip_changed(self, id):
+        row = self.vault.get_row(id)
+        if not row:
+            self.remove_id(id)
+        elif self.pinned_only:
+            self._place(row)
+        else:
+            self.update_row(row)
+
+class SearchResultsModel(ClipListModel):
+    more_requested = pyqtSignal()
+
+    def __init__(self, vault, parent=None):
+        super().__init__(parent)
+        self.vault = vault
+        self.has_more = False
+        self.pending = False
+        vault.events.clip_removed.connect(self.on_clip_removed)
+        vault.events.clip_changed.connect(self.on_clip_changed)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more and not self.pending
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.pending = True
+            self.more_requested.emit()
+
+    def on_clip_changed(self, id):
+        row = self.vault.get_row(id)
+        if row:
+            self.update_row(row)
 
 class ClipVaultGUI(QMainWindow):
+    search_requested = pyqtSignal(int, str, int)
+
     def __init__(self, vault):
         super().__init__()
         self.vault = vault
+        self.search_generation = 0
+        self.search_offset = 0
+        self.history_model = HistoryModel(vault, parent=self)
+        self.pinned_model = HistoryModel(vault, pinned_only=True, parent=self)
+        self.search_model = SearchResultsModel(vault, parent=self)
+        self.search_model.more_requested.connect(self.fetch_more_results)
+        vault.events.clip_added.connect(self.on_history_changed)
+        vault.events.history_reset.connect(self.on_history_changed)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.start_search)
+        self.search_thread = QThread(self)
+        self.search_worker = SearchWorker(vault)
+        self.search_worker.moveToThread(self.search_thread)
+        self.search_requested.connect(self.search_worker.run_query)
+        self.search_worker.results_ready.connect(self.show_search_results)
+        self.search_thread.start()
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(PREFETCH_DEBOUNCE_MS)
+        self.prefetch_timer.timeout.connect(self.prefetch_visible)
+        QPixmapCache.setCacheLimit(THUMBNAIL_CACHE_KB)
+        vault.events.clip_removed.connect(self.vault.forget_thumbnail)
+        vault.events.history_reset.connect(QPixmapCache.clear)
         self.setWindowTitle("ClipVault")
         self.setGeometry(100, 100, 800, 600)
         self.setStyleSheet("""
             QMainWindow, QWidget {background-color: #F0F0F0;font-family: Arial;}
-            QListWidget {background-color: white;border: 1px solid #CCCCCC;
+            QListView {background-color: white;border: 1px solid #CCCCCC;
                 font-size: 12px;alternate-background-color: #F9F9F9;}
             QTabWidget::pane {border: 0;}
             QTabBar::tab {background: #E0E0E0;padding: 8px 15px;
@@ -52,7 +2033,6 @@ class ClipVaultGUI(QMainWindow):
         self.tab_widget.addTab(self.settings_tab, "Settings")
         self.status_bar = self.statusBar()
         self.update_status("Ready")
-        self.refresh_data()
     
     def _create_history_tab(self):
         tab = QWidget()
@@ -60,31 +2040,38 @@ class ClipVaultGUI(QMainWindow):
         search_layout = QHBoxLayout()
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("Search history...")
-        self.search_input.textChanged.connect(self.filter_history)
+        self.search_input.textChanged.connect(self.search_timer.start)
         search_layout.addWidget(self.search_input)
         clear_btn = QPushButton("Clear Unpinned")
         clear_btn.clicked.connect(self.clear_unpinned)
         search_layout.addWidget(clear_btn)
         layout.addLayout(search_layout)
-        self.history_list = QListWidget()
-        self.history_list.itemDoubleClicked.connect(self.paste_selected)
-        self.history_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.history_list = self._create_list_view(self.history_model)
         self.history_list.customContextMenuRequested.connect(self.show_history_context_menu)
-        self.history_list.setAlternatingRowColors(True)
         layout.addWidget(self.history_list)
         return tab
     
     def _create_pinned_tab(self):
         tab = QWidget()
         layout = QVBoxLayout(tab)
-        self.pinned_list = QListWidget()
-        self.pinned_list.itemDoubleClicked.connect(self.paste_selected)
-        self.pinned_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.pinned_list = self._create_list_view(self.pinned_model)
         self.pinned_list.customContextMenuRequested.connect(self.show_pinned_context_menu)
-        self.pinned_list.setAlternatingRowColors(True)
         layout.addWidget(self.pinned_list)
         return tab
     
+    def _create_list_view(self, model):
+        view = QListView()
+        view.setModel(model)
+        view.setUniformItemSizes(True)
+        view.setIconSize(QSize(THUMBNAIL_VIEW_SIZE, THUMBNAIL_VIEW_SIZE))
+        view.doubleClicked.connect(self.paste_selected)
+        view.setContextMenuPolicy(Qt.CustomContextMenu)
+        view.setAlternatingRowColors(True)
+        view.verticalScrollBar().valueChanged.connect(self.prefetch_timer.start)
+        model.rowsInserted.connect(self.prefetch_timer.start)
+        model.modelReset.connect(self.prefetch_timer.start)
+        return view
+    
     def _create_settings_tab(self):
         tab = QWidget()
         layout = QVBoxLayout(tab)
@@ -93,16 +2080,20 @@ class ClipVaultGUI(QMainWindow):
         mem_layout = QVBoxLayout(mem_group)
         mem_layout.addWidget(QLabel("<b>Memory Optimization</b>"))
         cache_layout = QHBoxLayout()
-        cache_layout.addWidget(QLabel("Cache Size:"))
-        self.cache_size = QSlider(Qt.Horizontal)
-        self.cache_size.setMinimum(5)
-        self.cache_size.setMaximum(50)
-        self.cache_size.setValue(self.vault.cache_size)
-        self.cache_size.valueChanged.connect(self.update_cache_size)
-        cache_layout.addWidget(self.cache_size)
-        self.cache_label = QLabel(f"{self.vault.cache_size} items")
+        cache_layout.addWidget(QLabel("Cache Memory:"))
+        self.cache_budget = QSlider(Qt.Horizontal)
+        self.cache_budget.setMinimum(1)
+        self.cache_budget.setMaximum(128)
+        self.cache_budget.setValue(self.vault.cache_budget_mb)
+        self.cache_budget.valueChanged.connect(self.update_cache_budget)
+        cache_layout.addWidget(self.cache_budget)
+        self.cache_label = QLabel(f"{self.vault.cache_budget_mb} MB")
         cache_layout.addWidget(self.cache_label)
         mem_layout.addLayout(cache_layout)
+        self.cache_stats_label = QLabel()
+        mem_layout.addWidget(self.cache_stats_label)
+        self.tab_widget.currentChanged.connect(self.update_cache_stats)
+        self.tab_widget.currentChanged.connect(self.prefetch_timer.start)
         quality_layout = QHBoxLayout()
         quality_layout.addWidget(QLabel("Image Quality:"))
         self.quality_slider = QSlider(Qt.Horizontal)
@@ -114,10 +2105,71 @@ class ClipVaultGUI(QMainWindow):
         self.quality_label = QLabel(f"{self.vault.image_quality}%")
         quality_layout.addWidget(self.quality_label)
         mem_layout.addLayout(quality_layout)
+        ceiling_layout = QHBoxLayout()
+        ceiling_layout.addWidget(QLabel("Memory Ceiling:"))
+        self.ceiling_slider = QSlider(Qt.Horizontal)
+        self.ceiling_slider.setMinimum(3)
+        self.ceiling_slider.setMaximum(64)
+        self.ceiling_slider.setValue(self.vault.governor.ceiling // (16 * 1024 ** 2))
+        self.ceiling_slider.valueChanged.connect(self.update_memory_ceiling)
+        ceiling_layout.addWidget(self.ceiling_slider)
+        self.ceiling_label = QLabel(f"{self.ceiling_slider.value() * 16} MB")
+        ceiling_layout.addWidget(self.ceiling_label)
+        mem_layout.addLayout(ceiling_layout)
         layout.addWidget(mem_group)
+        debounce_layout = QHBoxLayout()
+        debounce_layout.addWidget(QLabel("Clipboard Debounce:"))
+        self.debounce_slider = QSlider(Qt.Horizontal)
+        self.debounce_slider.setMinimum(0)
+        self.debounce_slider.setMaximum(20)
+        self.debounce_slider.setValue(self.vault.clipboard_debounce_ms // 50)
+        self.debounce_slider.valueChanged.connect(self.update_clipboard_debounce)
+        debounce_layout.addWidget(self.debounce_slider)
+        self.debounce_label = QLabel(f"{self.vault.clipboard_debounce_ms} ms")
+        debounce_layout.addWidget(self.debounce_label)
+        layout.addLayout(debounce_layout)
+        trace_events = QCheckBox("Trace clipboard events to the metrics log")
+        trace_events.setChecked(self.vault.metrics.tracing)
+        trace_events.toggled.connect(self.update_tracing)
+        layout.addWidget(trace_events)
+        fold_images = QCheckBox("Fold near-duplicate screenshots into one entry")
+        fold_images.setChecked(self.vault.fold_similar_images)
+        fold_images.toggled.connect(self.update_fold_images)
+        layout.addWidget(fold_images)
         auto_clear = QCheckBox("Auto-clear temporary items after 24 hours")
-        auto_clear.setChecked(True)
+        auto_clear.setChecked(bool(self.vault.retention.policy['max_age_hours']))
+        auto_clear.toggled.connect(self.update_auto_clear)
         layout.addWidget(auto_clear)
+        storage_layout = QHBoxLayout()
+        storage_layout.addWidget(QLabel("History Storage:"))
+        self.storage_slider = QSlider(Qt.Horizontal)
+        self.storage_slider.setMinimum(1)
+        self.storage_slider.setMaximum(64)
+        self.storage_slider.setValue(self.vault.retention.policy['max_total_bytes'] // (128 * 1024 ** 2))
+        self.storage_slider.valueChanged.connect(self.update_storage_limit)
+        storage_layout.addWidget(self.storage_slider)
+        self.storage_label = QLabel(f"{self.storage_slider.value() * 128} MB")
+        storage_layout.addWidget(self.storage_label)
+        layout.addLayout(storage_layout)
+        oversize_layout = QHBoxLayout()
+        oversize_layout.addWidget(QLabel(f"Clips over {self.vault.max_clip_bytes // 1024 ** 2} MB:"))
+        self.oversize_combo = QComboBox()
+        for policy, label in MAX_CLIP_POLICIES.items():
+            self.oversize_combo.addItem(label, policy)
+        self.oversize_combo.setCurrentIndex(list(MAX_CLIP_POLICIES).index(self.vault.max_clip_policy))
+        self.oversize_combo.currentIndexChanged.connect(self.update_oversize_policy)
+        oversize_layout.addWidget(self.oversize_combo)
+        layout.addLayout(oversize_layout)
+        archive_layout = QHBoxLayout()
+        export_btn = QPushButton("Export History...")
+        export_btn.clicked.connect(self.export_history)
+        archive_layout.addWidget(export_btn)
+        import_btn = QPushButton("Import History...")
+        import_btn.clicked.connect(self.import_history)
+        archive_layout.addWidget(import_btn)
+        layout.addLayout(archive_layout)
+        self.vault.events.transfer_progress.connect(self.show_transfer_progress)
+        self.vault.events.transfer_finished.connect(self.show_transfer_finished)
         save_btn = QPushButton("Save Settings")
         save_btn.clicked.connect(self.save_settings)
         layout.addWidget(save_btn)
@@ -125,9 +2177,9 @@ class ClipVaultGUI(QMainWindow):
         return tab
     
     def show_history_context_menu(self, pos):
-        item = self.history_list.itemAt(pos)
-        if not item: return
-        id = item.data(Qt.UserRole)
+        index = self.history_list.indexAt(pos)
+        if not index.isValid(): return
+        id = index.data(Qt.UserRole)
         menu = QMenu()
         if self.vault.is_pinned(id):
             unpin_action = QAction("Unpin", menu)
@@ -137,15 +2189,19 @@ class ClipVaultGUI(QMainWindow):
             pin_action = QAction("Pin", menu)
             pin_action.triggered.connect(lambda: self.toggle_pin(id))
             menu.addAction(pin_action)
+        if self.vault.get_type(id) == 'image':
+            similar_action = QAction("Find Similar Images", menu)
+            similar_action.triggered.connect(lambda: self.search_input.setText(f"similar:{id}"))
+            menu.addAction(similar_action)
         delete_action = QAction("Delete", menu)
         delete_action.triggered.connect(lambda: self.delete_item(id))
         menu.addAction(delete_action)
         menu.exec_(self.history_list.mapToGlobal(pos))
     
     def show_pinned_context_menu(self, pos):
-        item = self.pinned_list.itemAt(pos)
-        if not item: return
-        id = item.data(Qt.UserRole)
+        index = self.pinned_list.indexAt(pos)
+        if not index.isValid(): return
+        id = index.data(Qt.UserRole)
         menu = QMenu()
         unpin_action = QAction("Unpin", menu)
         unpin_action.triggered.connect(lambda: self.toggle_pin(id))
@@ -157,21 +2213,107 @@ class ClipVaultGUI(QMainWindow):
     
     def toggle_pin(self, id):
         self.vault.toggle_pin(id)
-        self.refresh_data()
     
     def delete_item(self, id):
         self.vault.delete_item(id)
-        self.refresh_data()
     
-    def filter_history(self):
-        search_term = self.search_input.text().lower()
-        for i in range(self.history_list.count()):
-            item = self.history_list.item(i)
-            item.setHidden(search_term not in item.text().lower())
+    def start_search(self):
+        self.search_generation += 1
+        query = self.search_input.text().strip()
+        self.search_model.pending = False
+        self.search_model.has_more = False
+        if not query:
+            self.history_list.setModel(self.history_model)
+            return
+        self.search_offset = 0
+        self.search_model.pending = True
+        self.search_requested.emit(self.search_generation, query, 0)
+    
+    def fetch_more_results(self):
+        query = self.search_input.text().strip()
+        if query:
+            self.search_requested.emit(self.search_generation, query, self.search_offset)
+    
+    def show_search_results(self, generation, offset, rows, has_more):
+        if generation != self.search_generation:
+            return
+        self.search_model.pending = False
+        self.search_model.has_more = has_more
+        self.search_offset = offset + len(rows)
+        with self.vault.metrics.timed('clipvault_ui_refresh_seconds', view='search'):
+            if offset == 0:
+                self.search_model.reset_rows(rows)
+                self.history_list.setModel(self.search_model)
+            else:
+                self.search_model.append_rows(rows)
+        self.update_status(f"{self.search_offset}{'+' if has_more else ''} matching items")
+    
+    def on_history_changed(self, *args):
+        if self.search_input.text().strip():
+            self.search_timer.start()
+    
+    def stop_search(self):
+        self.search_thread.quit()
+        self.search_thread.wait()
+    
+    def update_cache_budget(self, budget_mb):
+        self.vault.set_cache_budget(budget_mb)
+        self.cache_label.setText(f"{budget_mb} MB")
+        self.update_cache_stats()
+    
+    def update_cache_stats(self):
+        stats = self.vault.cache.stats()
+        prefetch = self.vault.prefetcher.stats()
+        requests = stats['hits'] + stats['misses']
+        gain = 100.0 * prefetch['hits'] / requests if requests else 0.0
+        self.cache_stats_label.setText(
+            f"{stats['bytes'] / 1024 ** 2:.1f} MB in {stats['items']} items, "
+            f"{stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions\n"
+            f"Prefetched {prefetch['loaded']} items, {prefetch['hits']} used ({gain:.0f}% of lookups)")
+    
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.prefetch_timer.start()
+    
+    def prefetch_visible(self):
+        if not self.isVisible():
+            return
+        view = self.pinned_list if self.tab_widget.currentWidget() is self.pinned_tab else self.history_list
+        model = view.model()
+        rect = view.viewport().rect()
+        first = view.indexAt(rect.topLeft()).row()
+        if first < 0:
+            return
+        last = view.indexAt(rect.bottomLeft()).row()
+        if last < 0:
+            last = model.rowCount() - 1
+        self.vault.prefetcher.request([model.index(row).data(Qt.UserRole) for row in range(first, last + 1)],
+                                      'visible')
+    
+    def update_clipboard_debounce(self, steps):
+        self.vault.clipboard_debounce_ms = steps * 50
+        self.debounce_label.setText(f"{steps * 50} ms")
+
+    def update_tracing(self, enabled):
+        self.vault.metrics.tracing = enabled
+
+    def update_fold_images(self, enabled):
+        self.vault.fold_similar_images = enabled
+
+    def update_auto_clear(self, enabled):
+        self.vault.retention.policy['max_age_hours'] = RETENTION_DEFAULTS['max_age_hours'] if enabled else None
+        self.vault.retention.start_sweep()
+    
+    def update_memory_ceiling(self, steps):
+        self.vault.governor.ceiling = steps * 16 * 1024 ** 2
+        self.ceiling_label.setText(f"{steps * 16} MB")
     
-    def update_cache_size(self, size):
-        self.vault.cache_size = size
-        self.cache_label.setText(f"{size} items")
+    def update_storage_limit(self, steps):
+        self.vault.retention.policy['max_total_bytes'] = steps * 128 * 1024 ** 2
+        self.storage_label.setText(f"{steps * 128} MB")
+    
+    def update_oversize_policy(self, index):
+        self.vault.max_clip_policy = self.oversize_combo.itemData(index)
     
     def update_image_quality(self, quality):
         self.vault.image_quality = quality
@@ -180,87 +2322,258 @@ class ClipVaultGUI(QMainWindow):
     def save_settings(self):
         self.update_status("Settings saved")
     
-    def refresh_data(self):
-        self.history_list.clear()
-        for id, preview, ctype, pinned in self.vault.history:
-            item = QListWidgetItem(f"{'📌 ' if pinned else ''}{preview} ({ctype})")
-            item.setData(Qt.UserRole, id)
-            if pinned:
-                item.setData(Qt.UserRole + 1, "pinned")
-            self.history_list.addItem(item)
-        self.pinned_list.clear()
-        for id, preview, ctype in self.vault.get_pinned():
-            item = QListWidgetItem(f"📌 {preview} ({ctype})")
-            item.setData(Qt.UserRole, id)
-            item.setData(Qt.UserRole + 1, "pinned")
-            self.pinned_list.addItem(item)
-    
-    def paste_selected(self, item):
-        id = item.data(Qt.UserRole)
+    def paste_selected(self, index):
+        id = index.data(Qt.UserRole)
         self.vault.paste_item(id)
         self.update_status("Item pasted to clipboard")
     
     def clear_unpinned(self):
         self.vault.clear_unpinned()
-        self.refresh_data()
         self.update_status("Unpinned history cleared")
     
+    def export_history(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export History", "clipvault.archive")
+        if path and not self.vault.start_transfer('export', path):
+            self.update_status("Another export or import is running")
+    
+    def import_history(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import History")
+        if path and not self.vault.start_transfer('import', path):
+            self.update_status("Another export or import is running")
+    
+    def show_transfer_progress(self, kind, done, total):
+        self.update_status(f"{kind.capitalize()}ing history... {done * 100 // max(total, 1)}%")
+    
+    def show_transfer_finished(self, kind, message):
+        if message.startswith('failed'):
+            self.update_status(f"{kind.capitalize()} {message}")
+        else:
+            self.update_status(f"{kind.capitalize()} finished: {message}")
+    
     def update_status(self, message):
         self.status_bar.showMessage(message)
 
+class QuickPickModel(ClipListModel):
+    def __init__(self, vault, parent=None):
+        super().__init__(parent)
+        self.vault = vault
+        vault.events.clip_removed.connect(self.on_clip_removed)
+
+class QuickPick(QWidget):
+    def __init__(self, vault):
+        super().__init__(None, Qt.Tool | Qt.FramelessWindowHint | Qt.WindowStaysOnTopHint)
+        self.vault = vault
+        self.model = QuickPickModel(vault, self)
+        layout = QVBoxLayout(self)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Type to find a clip...")
+        self.search_input.textChanged.connect(self.refresh)
+        self.search_input.installEventFilter(self)
+        layout.addWidget(self.search_input)
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setIconSize(QSize(THUMBNAIL_VIEW_SIZE, THUMBNAIL_VIEW_SIZE))
+        self.list_view.setFocusPolicy(Qt.NoFocus)
+        self.list_view.clicked.connect(self.pick)
+        layout.addWidget(self.list_view)
+        self.resize(QUICK_PICK_WIDTH, QUICK_PICK_HEIGHT)
+
+    def popup(self):
+        self.search_input.clear()
+        self.refresh()
+        screen = QApplication.primaryScreen().availableGeometry()
+        self.move(screen.center() - self.rect().center())
+        self.show()
+        self.raise_()
+        self.activateWindow()
+        self.search_input.setFocus()
+
+    def refresh(self):
+        self.model.reset_rows(self.vault.fuzzy_search(self.search_input.text()))
+        if self.model.rowCount():
+            self.list_view.setCurrentIndex(self.model.index(0))
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.KeyPress:
+            key = event.key()
+            if key in (Qt.Key_Up, Qt.Key_Down):
+                row = self.list_view.currentIndex().row() + (1 if key == Qt.Key_Down else -1)
+                if 0 <= row < self.model.rowCount():
+                    self.list_view.setCurrentIndex(self.model.index(row))
+                return True
+            if key in (Qt.Key_Return, Qt.Key_Enter):
+                self.pick(self.list_view.currentIndex())
+                return True
+            if key == Qt.Key_Escape:
+                self.hide()
+                return True
+        return super().eventFilter(obj, event)
+
+    def event(self, event):
+        if event.type() == QEvent.WindowDeactivate:
+            self.hide()
+        return super().event(event)
+
+    def pick(self, index):
+        self.hide()
+        if index.isValid():
+            self.vault.paste_item(index.data(Qt.UserRole))
+
 class ClipVault:
     def __init__(self):
+        self.startup = ClipTrace('startup')
         self.app = QApplication(sys.argv)
         self.app.setQuitOnLastWindowClosed(False)
         self.clipboard = QApplication.clipboard()
+        self.startup.mark('qt')
+        self.events = VaultEvents()
+        self.gui = None
         self.history = []
-        self.data_dir = "clipvault_data"
+        self.tray_pinned = []
+        self.tray_signature = None
+        self.home = os.path.abspath(os.path.expanduser(VAULT_HOME or '.'))
+        self.data_dir = os.path.join(self.home, "clipvault_data")
+        self.db_path = os.path.join(self.home, "clipvault.db")
+        self.instance = int.from_bytes(os.urandom(7), 'big')
         os.makedirs(self.data_dir, exist_ok=True)
+        self.fts_enabled = False
+        self.metrics = MetricsRegistry()
+        self.metrics.open_log(os.path.join(self.home, METRICS_LOG))
+        self.metrics_server = None
+        self.process = None
+        self.governor = MemoryGovernor(self, MEMORY_CEILING_MB * 1024 ** 2)
         self.tray = QSystemTrayIcon()
         self.tray.setIcon(self._create_icon())
         self.menu = QMenu()
         self.tray.setContextMenu(self.menu)
         self.tray.activated.connect(self.tray_activated)
         self.tray.show()
-        self.db = sqlite3.connect('clipvault.db')
+        self.startup.mark('tray')
+        self.cache_budget_mb = CACHE_BUDGET_MB
+        self.cache = ContentCache(self.cache_budget_mb * 1024 ** 2)
+        self.prefetcher = Prefetcher(self)
+        self.db = self.connect()
         self._ensure_schema()
-        self._clear_on_startup()
+        self.startup.mark('schema')
+        self.segments = SegmentStore(os.path.join(self.data_dir, SEGMENT_DIR), self.metrics, self.home)
+        try:
+            self.segments.recover(self.db)
+        except (OSError, sqlite3.Error) as e:
+            self.metrics.inc('clipvault_segment_recovery_errors_total')
+            self.tray.showMessage("ClipVault", f"Segment recovery skipped: {e}", QSystemTrayIcon.Warning)
+        self.startup.mark('segments')
+        self.retention = RetentionEngine(self)
         self.load_history()
-        self.lru_cache = OrderedDict()
-        self.cache_size = 10
         self.image_quality = 85
-        self.clipboard.dataChanged.connect(self.check_clipboard)
-        self.gui = ClipVaultGUI(self)
-        self.gui.hide()
+        self.max_clip_bytes = MAX_CLIP_BYTES
+        self.max_clip_policy = MAX_CLIP_POLICY
+        self.fold_similar_images = False
+        self.transfer = None
+        self.image_index = None
+        self.image_index_lock = threading.Lock()
+        self.quick_pick = None
+        self.fuzzy_index = None
+        self.fuzzy_pending = None
+        self.fuzzy_stale = False
+        self.fuzzy_lock = threading.Lock()
+        self.events.clip_added.connect(lambda id: self._on_fuzzy_event('added', id))
+        self.events.clip_removed.connect(lambda id: self._on_fuzzy_event('removed', id))
+        self.events.clip_changed.connect(lambda id: self._on_fuzzy_event('changed', id))
+        self.events.history_reset.connect(self.start_fuzzy_index)
+        self.events.transfer_finished.connect(self._on_transfer_finished, Qt.QueuedConnection)
+        self.ingest = IngestPipeline(self)
+        self.ingest.stored.connect(self._on_ingested, Qt.QueuedConnection)
+        self.ingest.dropped.connect(self._on_ingest_dropped, Qt.QueuedConnection)
+        self.clipboard_debounce_ms = CLIPBOARD_DEBOUNCE_MS
+        self.clipboard_fingerprint = None
+        self.pending_trace = None
+        self.clipboard_timer = QTimer()
+        self.clipboard_timer.setSingleShot(True)
+        self.clipboard_timer.timeout.connect(self.check_clipboard)
+        self.clipboard.dataChanged.connect(self._on_clipboard_changed)
+        self.data_version = self.db.execute("PRAGMA data_version").fetchone()[0]
+        self.change_seq = self.db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+        self.change_timer = QTimer()
+        self.change_timer.setInterval(CHANGE_POLL_MS)
+        self.change_timer.timeout.connect(self.poll_changes)
+        self.change_timer.start()
+        self.startup.mark('listener')
+        self.ipc = None
         self._setup_tray_menu()
-        self.mem_log = open("memory.log", "w")
-        QTimer.singleShot(1000, self._log_memory)
+        self.metrics_timer = QTimer()
+        self.metrics_timer.setInterval(METRICS_INTERVAL_MS)
+        self.metrics_timer.timeout.connect(self._log_metrics)
+        self.metrics_timer.start()
+        self.startup.mark('menu')
+        self._record_startup()
+        QTimer.singleShot(0, self._start_services)
+        self.startup_timer = QTimer()
+        self.startup_timer.setSingleShot(True)
+        self.startup_timer.timeout.connect(self._clear_on_startup)
+        self.startup_timer.start(STARTUP_IDLE_DELAY_MS)
+    
+    def _record_startup(self):
+        total = self.startup.total()
+        for phase, seconds in self.startup.stages.items():
+            self.metrics.observe('clipvault_startup_seconds', seconds, phase=phase)
+        self.metrics.set('clipvault_startup_total_seconds', total)
+        if total * 1000 > STARTUP_BUDGET_MS:
+            self.metrics.inc('clipvault_startup_over_budget_total')
+        self.metrics.write({'event': 'startup', 'total_ms': round(total * 1000, 3),
+                            'budget_ms': STARTUP_BUDGET_MS,
+                            'phases_ms': {phase: round(seconds * 1000, 3)
+                                          for phase, seconds in self.startup.stages.items()}})
+    
+    def _ensure_gui(self):
+        if self.gui is None:
+            with self.metrics.timed('clipvault_ui_refresh_seconds', view='window'):
+                self.gui = ClipVaultGUI(self)
+        return self.gui
     
     def tray_activated(self, reason):
         if reason == QSystemTrayIcon.DoubleClick:
             self.toggle_gui()
     
+    def show_quick_pick(self):
+        if self.quick_pick is None:
+            self.quick_pick = QuickPick(self)
+        self.quick_pick.popup()
+    
     def toggle_gui(self):
-        if self.gui.isVisible():
-            self.gui.hide()
+        gui = self._ensure_gui()
+        if gui.isVisible():
+            gui.hide()
         else:
-            self.gui.show()
-            self.gui.raise_()
-            self.gui.activateWindow()
-            self.gui.refresh_data()
+            gui.show()
+            gui.raise_()
+            gui.activateWindow()
     
     def _setup_tray_menu(self):
+        signature = (tuple(self.history), tuple(self.tray_pinned))
+        if signature == self.tray_signature:
+            return
+        with self.metrics.timed('clipvault_ui_refresh_seconds', view='tray'):
+            self._build_tray_menu()
+        self.tray_signature = signature
+        self.prefetcher.request([item[0] for item in self.tray_pinned[:TRAY_ITEMS]] +
+                                [item[0] for item in self.history[:TRAY_ITEMS]], 'tray')
+
+    def _build_tray_menu(self):
         self.menu.clear()
         show_action = QAction("Show ClipVault", self.menu)
         show_action.triggered.connect(self.toggle_gui)
         self.menu.addAction(show_action)
+        quick_pick_action = QAction("Quick Pick...", self.menu)
+        quick_pick_action.triggered.connect(self.show_quick_pick)
+        self.menu.addAction(quick_pick_action)
         self.menu.addSeparator()
         
         pinned_header = QAction("📌 Pinned Items", self.menu)
         pinned_header.setEnabled(False)
         self.menu.addAction(pinned_header)
         
-        pinned_items = self.get_pinned()[:5]
+        pinned_items = self.tray_pinned[:TRAY_ITEMS]
         for i, (id, preview, ctype) in enumerate(pinned_items):
             action = QAction(f"{i+1}: {preview}", self.menu)
             action.triggered.connect(lambda checked, id=id: self.paste_item(id))
@@ -272,7 +2585,7 @@ class ClipVault:
         recent_header.setEnabled(False)
         self.menu.addAction(recent_header)
         
-        recent_items = [item for item in self.history if not item[3]][:5]
+        recent_items = [item for item in self.history if not item[3]][:TRAY_ITEMS]
         for i, (id, preview, ctype, pinned) in enumerate(recent_items):
             action = QAction(f"{i+1}: {preview}", self.menu)
             action.triggered.connect(lambda checked, id=id: self.paste_item(id))
@@ -300,56 +2613,130 @@ class ClipVault:
         painter.end()
         return QIcon(pixmap)
     
-    def _log_memory(self):
+    def _rss(self):
         try:
-            import psutil
-            process = psutil.Process(os.getpid())
-            mem = process.memory_info().rss / 1024 ** 2
-            self.mem_log.write(f"{datetime.now().isoformat()},{mem:.2f}\n")
-            self.mem_log.flush()
+            if self.process is None:
+                import psutil
+                self.process = psutil.Process(os.getpid())
+            return self.process.memory_info().rss
         except ImportError:
-            pass
-        QTimer.singleShot(1000, self._log_memory)
+            return None
     
-    def _clear_on_startup(self):
+    def _update_gauges(self):
+        rss = self._rss()
+        if rss is not None:
+            self.metrics.set('clipvault_rss_bytes', rss)
+        stats = self.cache.stats()
+        self.metrics.set('clipvault_cache_bytes', stats['bytes'])
+        self.metrics.set('clipvault_cache_items', stats['items'])
+        self.metrics.set('clipvault_cache_evictions', stats['evictions'])
+        self.metrics.set('clipvault_ingest_queue_depth', self.ingest.queue.qsize())
+        segments = self.segments.stats()
+        self.metrics.set('clipvault_segment_files', segments['segments'])
+        self.metrics.set('clipvault_segment_bytes', segments['bytes'])
+        return rss
+
+    def _log_metrics(self):
         try:
-            cursor = self.db.execute('''SELECT id, content, storage FROM clips 
-                                     WHERE pinned = 0 AND 
-                                     datetime(created) < datetime('now', '-24 hours')''')
-            expired_items = cursor.fetchall()
-            for id, content, storage in expired_items:
-                if storage in ('file', 'mmap'):
-                    if content and os.path.exists(content):
-                        try:
-                            os.remove(content)
-                        except:
-                            pass
-            self.db.execute('''DELETE FROM clips 
-                            WHERE pinned = 0 AND 
-                            datetime(created) < datetime('now', '-24 hours')''')
-            self.db.commit()
+            self.governor.check(self._update_gauges())
+            self.metrics.write(dict(self.metrics.snapshot(), event='metrics'))
         except Exception:
             pass
+    
+    def poll_changes(self):
         try:
-            cursor = self.db.execute("SELECT content FROM clips WHERE storage IN ('file', 'mmap')")
-            referenced_files = {row[0] for row in cursor.fetchall()}
-            for filename in os.listdir(self.data_dir):
-                file_path = os.path.join(self.data_dir, filename)
-                if file_path not in referenced_files:
-                    try:
-                        if os.path.isfile(file_path):
-                            os.unlink(file_path)
-                    except Exception:
-                        pass
-            cursor = self.db.execute("SELECT id, content FROM clips WHERE storage IN ('file', 'mmap')")
-            for id, file_path in cursor.fetchall():
-                if not os.path.exists(file_path):
-                    self.db.execute("DELETE FROM clips WHERE id=?", (id,))
-            self.db.commit()
-        except Exception:
+            version = self.db.execute("PRAGMA data_version").fetchone()[0]
+            if version == self.data_version:
+                return
+            self.data_version = version
+            oldest, latest = self.db.execute("SELECT MIN(seq), MAX(seq) FROM changes").fetchone()
+            if latest is None or latest <= self.change_seq:
+                return
+            rows = self.db.execute('''SELECT clip_id, op FROM changes WHERE seq > ? AND seq <= ? 
+                                   AND origin IS NOT ? ORDER BY seq LIMIT ?''',
+                                   (self.change_seq, latest, self.instance, CHANGE_BATCH_LIMIT + 1)).fetchall()
+        except sqlite3.Error:
+            return
+        lost = oldest > self.change_seq + 1
+        self.change_seq = latest
+        if len(rows) > CHANGE_BATCH_LIMIT or lost:
+            self.cache.clear()
+            self.events.history_reset.emit()
+            self.load_history()
+            return
+        if not rows:
+            return
+        for id, op in rows:
+            if op == 'removed':
+                self.cache.pop(id)
+                self.events.clip_removed.emit(id)
+            elif op == 'added':
+                self.events.clip_added.emit(id)
+            else:
+                self.events.clip_changed.emit(id)
+        self.load_history()
+    
+    def _start_services(self):
+        with self.metrics.timed('clipvault_startup_seconds', phase='services'):
+            self.ingest.start()
+            self.prefetcher.start()
+            try:
+                self.ipc = IpcServer(self)
+                self.ipc.command.connect(self._on_ipc_command, Qt.QueuedConnection)
+            except OSError:
+                pass
+    
+    def _clear_on_startup(self):
+        with self.metrics.timed('clipvault_startup_seconds', phase='maintenance'):
+            try:
+                self.metrics_server = MetricsServer(self.metrics)
+            except OSError:
+                pass
+        self.prefetch_frequent()
+        self.start_fuzzy_index()
+        self.retention.start()
+    
+    def prefetch_frequent(self):
+        try:
+            rows = self.db.execute('''SELECT id FROM clips WHERE pastes > 0 
+                                   ORDER BY pastes DESC, created DESC LIMIT ?''', (PREFETCH_FREQUENT,)).fetchall()
+        except sqlite3.Error:
+            return
+        self.prefetcher.request([row[0] for row in rows], 'frequent')
+    
+    def connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30, factory=TimedConnection)
+        db.metrics = self.metrics
+        for pragma in SQLITE_PRAGMAS:
+            db.execute(pragma)
+        self._tag_changes(db)
+        return db
+    
+    def _tag_changes(self, db):
+        try:
+            db.execute(f'''CREATE TEMP TRIGGER IF NOT EXISTS changes_origin AFTER INSERT ON main.changes 
+                       BEGIN UPDATE changes SET origin = {self.instance} WHERE seq = new.seq; END''')
+        except sqlite3.OperationalError:
             pass
     
     def _ensure_schema(self):
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(SCHEMA_MIGRATIONS, 1):
+            if version >= number:
+                continue
+            try:
+                self.db.execute("BEGIN")
+                getattr(self, migration)()
+                self.db.execute(f"PRAGMA user_version = {number}")
+                self.db.commit()
+            except sqlite3.Error:
+                self.db.rollback()
+                break
+        self.fts_enabled = bool(self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='clips_fts'").fetchone())
+        self._tag_changes(self.db)
+    
+    def _migrate_base_schema(self):
         self.db.execute('''CREATE TABLE IF NOT EXISTS clips(
             id INTEGER PRIMARY KEY,
             content BLOB,
@@ -360,7 +2747,8 @@ class ClipVault:
         columns_to_add = [
             ('preview', 'TEXT'),
             ('storage', 'TEXT'),
-            ('size', 'INTEGER')
+            ('size', 'INTEGER'),
+            ('hash', 'TEXT')
         ]
         cursor = self.db.execute("PRAGMA table_info(clips)")
         existing_columns = [row[1] for row in cursor.fetchall()]
@@ -370,9 +2758,513 @@ class ClipVault:
                     self.db.execute(f"ALTER TABLE clips ADD COLUMN {col} {col_type}")
                 except sqlite3.OperationalError:
                     pass
-        self.db.commit()
+    
+    def _migrate_retention(self):
+        self.db.execute("CREATE TABLE IF NOT EXISTS pending_unlink(path TEXT PRIMARY KEY)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_blobs_storage ON blobs(storage)")
+    
+    def _migrate_codecs(self):
+        cursor = self.db.execute("PRAGMA table_info(blobs)")
+        existing_columns = [row[1] for row in cursor.fetchall()]
+        for col, col_type in (('codec', 'TEXT'), ('raw_size', 'INTEGER'), ('cold', 'INTEGER DEFAULT 0')):
+            if col not in existing_columns:
+                self.db.execute(f"ALTER TABLE blobs ADD COLUMN {col} {col_type}")
+    
+    def _migrate_segments(self):
+        cursor = self.db.execute("PRAGMA table_info(blobs)")
+        if 'segment_offset' not in [row[1] for row in cursor.fetchall()]:
+            self.db.execute("ALTER TABLE blobs ADD COLUMN segment_offset INTEGER")
+        self.db.execute('''CREATE INDEX IF NOT EXISTS idx_blobs_segment ON blobs(content, segment_offset) 
+                        WHERE storage = 'segment' ''')
+    
+    def _migrate_paste_counts(self):
+        cursor = self.db.execute("PRAGMA table_info(clips)")
+        if 'pastes' not in [row[1] for row in cursor.fetchall()]:
+            self.db.execute("ALTER TABLE clips ADD COLUMN pastes INTEGER DEFAULT 0")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_clips_pastes ON clips(pastes) WHERE pastes > 0")
+    
+    def _migrate_thumbnails(self):
+        self.db.execute("CREATE TABLE IF NOT EXISTS thumbnails(hash TEXT PRIMARY KEY, data BLOB)")
+    
+    def _migrate_perceptual_hashes(self):
+        cursor = self.db.execute("PRAGMA table_info(thumbnails)")
+        if 'phash' not in [row[1] for row in cursor.fetchall()]:
+            self.db.execute("ALTER TABLE thumbnails ADD COLUMN phash INTEGER")
+    
+    def _migrate_blank_phashes(self):
+        self.db.execute("UPDATE thumbnails SET phash = NULL WHERE phash = 0")
+    
+    def _migrate_change_log(self):
+        self.db.execute('''CREATE TABLE IF NOT EXISTS changes(
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            clip_id INTEGER,
+            op TEXT
+        )''')
+        for name, event, op in (('insert', 'INSERT', 'added'), ('touch', 'UPDATE OF created', 'added'),
+                                ('update', 'UPDATE OF pinned, preview', 'changed'),
+                                ('delete', 'DELETE', 'removed')):
+            row = 'old' if op == 'removed' else 'new'
+            self.db.execute(f'''CREATE TRIGGER IF NOT EXISTS clips_change_{name} AFTER {event} ON clips 
+                            BEGIN INSERT INTO changes (clip_id, op) VALUES ({row}.id, '{op}'); END''')
+    
+    def _migrate_change_origin(self):
+        self.db.execute("ALTER TABLE changes ADD COLUMN origin INTEGER")
+    
+    def _migrate_absolute_paths(self):
+        home = os.path.dirname(os.path.abspath(self.db_path)) + os.sep
+        self.db.execute('''UPDATE blobs SET content = ? || content 
+                        WHERE storage IN ('segment', 'file', 'mmap') AND substr(content, 1, 1) != ?''', (home, os.sep))
+        self.db.execute("UPDATE OR REPLACE pending_unlink SET path = ? || path WHERE substr(path, 1, 1) != ?",
+                        (home, os.sep))
+    
+    def _migrate_relative_paths(self):
+        marker = os.sep + os.path.basename(self.data_dir) + os.sep
+        relative = lambda path: path[path.rfind(marker) + 1:] if os.path.isabs(path) and marker in path else path
+        rows = self.db.execute('''SELECT hash, content FROM blobs 
+                               WHERE storage IN ('segment', 'file', 'mmap')''').fetchall()
+        self.db.executemany("UPDATE blobs SET content=? WHERE hash=?",
+                            [(relative(path), digest) for digest, path in rows if relative(path) != path])
+        rows = self.db.execute("SELECT path FROM pending_unlink").fetchall()
+        self.db.executemany("UPDATE OR REPLACE pending_unlink SET path=? WHERE path=?",
+                            [(relative(path), path) for (path,) in rows if relative(path) != path])
+    
+    def _migrate_unreferenced_index(self):
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(hash) WHERE refs <= 0")
+    
+    def _migrate_history_indexes(self):
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_clips_created ON clips(created, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_clips_pinned ON clips(pinned, created, id)")
+    
+    def _ensure_blob_store(self):
+        self.db.execute('''CREATE TABLE IF NOT EXISTS blobs(
+            hash TEXT PRIMARY KEY,
+            content BLOB,
+            storage TEXT,
+            size INTEGER,
+            refs INTEGER DEFAULT 0
+        )''')
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_clips_hash ON clips(hash, type)")
+        cursor = self.db.execute("SELECT id, content, storage FROM clips WHERE hash IS NULL")
+        for id, content, storage in cursor.fetchall():
+            try:
+                if storage in ('file', 'mmap'):
+                    digest, size = self._hash_file(self.resolve(content))
+                else:
+                    if isinstance(content, str):
+                        content = content.encode('utf-8')
+                    content = content or b''
+                    digest, size = hashlib.sha256(content).hexdigest(), len(content)
+                    storage = 'db'
+            except OSError:
+                self.db.execute("DELETE FROM clips WHERE id=?", (id,))
+                continue
+            if self.db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+                if storage != 'db':
+                    try:
+                        os.remove(self.resolve(content))
+                    except OSError:
+                        pass
+            else:
+                self.db.execute('''INSERT INTO blobs (hash, content, storage, size, refs) 
+                                VALUES (?, ?, ?, ?, 0)''', (digest, content, storage, size))
+            self.db.execute("UPDATE blobs SET refs = refs + 1 WHERE hash=?", (digest,))
+            self.db.execute("UPDATE clips SET hash=?, content=NULL WHERE id=?", (digest, id))
+    
+    def resolve(self, path):
+        return os.path.join(self.home, path)
+    
+    def relative(self, path):
+        return os.path.relpath(path, self.home)
+    
+    def _hash_file(self, path):
+        digest = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+                size += len(chunk)
+        return digest.hexdigest(), size
+    
+    def _encode_blob(self, content, ctype, trace=None):
+        raw_size = len(content)
+        codec = None
+        if ctype in ('text', 'file') and raw_size >= COMPRESSION_THRESHOLD:
+            compressed = compress_payload(content, INGEST_CODEC)
+            if trace is not None:
+                trace.mark('compress')
+            if len(compressed) < raw_size * 0.9:
+                content = compressed
+                codec = INGEST_CODEC
+        size = len(content)
+        if size <= SEGMENT_THRESHOLD:
+            return content, 'db', size, codec, raw_size, None
+        stored, offset = self.segments.append(content)
+        if trace is not None:
+            trace.mark('write')
+        return stored, 'segment', size, codec, raw_size, offset
+    
+    def _acquire_blob(self, db, digest, content, ctype, trace=None, blob=None):
+        row = db.execute("SELECT storage FROM blobs WHERE hash=?", (digest,)).fetchone()
+        if row:
+            db.execute("UPDATE blobs SET refs = refs + 1 WHERE hash=?", (digest,))
+            return row[0]
+        blob = blob or self._encode_blob(content, ctype, trace)
+        db.execute('''INSERT INTO blobs (hash, content, storage, size, refs, codec, raw_size, segment_offset) 
+                   VALUES (?, ?, ?, ?, 1, ?, ?, ?)''', (digest,) + blob)
+        if trace is not None:
+            trace.mark('write')
+        return blob[1]
+    
+    def _migrate_legacy_files(self, db, limit=SEGMENT_MIGRATE_BATCH):
+        rows = db.execute('''SELECT hash, content FROM blobs WHERE storage IN ('file', 'mmap') 
+                          LIMIT ?''', (limit,)).fetchall()
+        moved = []
+        for digest, path in rows:
+            try:
+                with MappedContent(self.resolve(path)) as handle:
+                    moved.append(self.segments.append(handle.view) + (digest, path))
+            except (OSError, ValueError):
+                continue
+        if not moved:
+            return 0
+        self.segments.sync()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for stored, offset, digest, path in moved:
+                db.execute('''UPDATE blobs SET storage = 'segment', content = ?, segment_offset = ? 
+                           WHERE hash = ? AND content = ?''', (stored, offset, digest, path))
+                db.execute("INSERT OR IGNORE INTO pending_unlink (path) VALUES (?)", (path,))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        self._flush_unlinks(db)
+        return len(moved)
+    
+    def _make_thumbnail(self, image):
+        try:
+            if not isinstance(image, QImage):
+                image = QImage.fromData(bytes(image))
+            if image.isNull():
+                return None
+            thumb = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE, Qt.KeepAspectRatio,
+                                 Qt.SmoothTransformation).convertToFormat(QImage.Format_RGB32)
+            buffer = QBuffer()
+            buffer.open(QIODevice.WriteOnly)
+            thumb.save(buffer, "JPEG", THUMBNAIL_QUALITY)
+            data = bytes(buffer.data())
+            return data, self._thumbnail_hash(data)
+        except Exception:
+            return None
+    
+    def _thumbnail_hash(self, data):
+        thumb = QImage.fromData(data)
+        return None if thumb.isNull() else dhash(thumb)
+    
+    def _store_thumbnail(self, db, digest, thumb):
+        if db.execute("SELECT 1 FROM thumbnails WHERE hash=?", (digest,)).fetchone():
+            return
+        data, phash = thumb or (None, None)
+        if phash is None:
+            data = None
+        db.execute("INSERT OR IGNORE INTO thumbnails (hash, data, phash) VALUES (?, ?, ?)",
+                   (digest, data, None if phash is None else phash - (phash >> 63 << 64)))
+        if phash is not None and self.image_index is not None:
+            self.image_index.add(phash, digest)
+    
+    def _backfill_thumbnails(self, db, limit=THUMBNAIL_BACKFILL_BATCH):
+        rows = db.execute('''SELECT b.hash, b.content, b.storage, b.codec, b.raw_size, b.segment_offset, b.size 
+                          FROM blobs b WHERE EXISTS (SELECT 1 FROM clips c WHERE c.hash = b.hash AND c.type = 'image') 
+                          AND NOT EXISTS (SELECT 1 FROM thumbnails t WHERE t.hash = b.hash) 
+                          LIMIT ?''', (limit,)).fetchall()
+        for digest, stored, storage, codec, raw_size, offset, size in rows:
+            try:
+                content = self._read_blob(stored, storage, codec, raw_size, False, offset, size)
+            except Exception:
+                continue
+            if content is not None:
+                self._store_thumbnail(db, digest, self._make_thumbnail(content))
+        hashed = db.execute('''SELECT hash, data FROM thumbnails WHERE phash IS NULL AND data IS NOT NULL 
+                            LIMIT ?''', (limit,)).fetchall()
+        for digest, data in hashed:
+            db.execute("DELETE FROM thumbnails WHERE hash=?", (digest,))
+            self._store_thumbnail(db, digest, (data, self._thumbnail_hash(data)))
+        db.commit()
+        return len(rows) + len(hashed)
+    
+    def _image_index(self, db):
+        with self.image_index_lock:
+            if self.image_index is None:
+                index = BKTree()
+                for digest, phash in db.execute("SELECT hash, phash FROM thumbnails WHERE phash IS NOT NULL"):
+                    index.add(phash & 0xFFFFFFFFFFFFFFFF, digest)
+                self.image_index = index
+        return self.image_index
+    
+    def similar_images(self, id, distance=SIMILAR_IMAGE_DISTANCE, db=None):
+        db = db or self.db
+        row = db.execute('''SELECT t.phash FROM clips c JOIN thumbnails t ON t.hash = c.hash 
+                         WHERE c.id = ?''', (id,)).fetchone()
+        if not row or row[0] is None:
+            return []
+        matches = self._image_index(db).search(row[0] & 0xFFFFFFFFFFFFFFFF, distance)
+        ranks = {}
+        for rank, digest in matches[:SIMILAR_IMAGE_LIMIT]:
+            ranks.setdefault(digest, rank)
+        if not ranks:
+            return []
+        cur = db.execute(f'''SELECT id, preview, type, pinned, hash FROM clips 
+                         WHERE type = 'image' AND id != ? AND hash IN ({','.join('?' * len(ranks))}) 
+                         ORDER BY created DESC''', (id, *ranks))
+        rows = sorted(cur.fetchall(), key=lambda row: ranks[row[4]])
+        return [(row[0], row[1], row[2], bool(row[3])) for row in rows]
+    
+    def _fold_similar(self, db, phash, ctype, trace):
+        for distance, digest in self._image_index(db).search(phash, FOLD_IMAGE_DISTANCE):
+            duplicate = self._touch_duplicate(db, digest, ctype, trace)
+            if duplicate:
+                self.metrics.inc('clipvault_ingest_folded_total')
+                return duplicate
+        return None
+    
+    def thumbnail(self, id):
+        key = f"clipvault-thumb-{id}"
+        pixmap = QPixmapCache.find(key)
+        if pixmap is not None and not pixmap.isNull():
+            return pixmap
+        row = self.db.execute('''SELECT t.data FROM clips c JOIN thumbnails t ON t.hash = c.hash 
+                              WHERE c.id = ?''', (id,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        pixmap = QPixmap()
+        pixmap.loadFromData(row[0])
+        QPixmapCache.insert(key, pixmap)
+        return pixmap
+    
+    def forget_thumbnail(self, id):
+        QPixmapCache.remove(f"clipvault-thumb-{id}")
+    
+    def _release_blob(self, db, digest):
+        if digest is None:
+            return
+        db.execute("UPDATE blobs SET refs = refs - 1 WHERE hash=?", (digest,))
+        row = db.execute("SELECT content, storage FROM blobs WHERE hash=? AND refs <= 0", (digest,)).fetchone()
+        if not row:
+            return
+        db.execute("DELETE FROM blobs WHERE hash=?", (digest,))
+        if self.image_index is not None:
+            thumb = db.execute("SELECT phash FROM thumbnails WHERE hash=? AND phash IS NOT NULL", (digest,)).fetchone()
+            if thumb:
+                self.image_index.discard(thumb[0] & 0xFFFFFFFFFFFFFFFF, digest)
+        db.execute("DELETE FROM thumbnails WHERE hash=?", (digest,))
+        content, storage = row
+        if storage in ('file', 'mmap'):
+            db.execute("INSERT OR IGNORE INTO pending_unlink (path) VALUES (?)", (content,))
+    
+    def _reclaim_unreferenced(self, db):
+        digests = [row[0] for row in db.execute("SELECT hash FROM blobs WHERE refs <= 0").fetchall()]
+        for digest in digests:
+            self._release_blob(db, digest)
+        self._commit_deletions(db)
+        return len(digests)
+    
+    def _commit_deletions(self, db, removed=()):
+        db.commit()
+        self._announce_removed(removed)
+        self._flush_unlinks(db)
+    
+    def _announce_removed(self, removed):
+        if len(removed) > BULK_CHANGE_THRESHOLD:
+            self.events.history_reset.emit()
+        else:
+            for id in removed:
+                self.events.clip_removed.emit(id)
+    
+    def _flush_unlinks(self, db):
+        paths = [row[0] for row in db.execute("SELECT path FROM pending_unlink").fetchall()]
+        if not paths:
+            return 0
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for path in paths:
+                if self._is_referenced(db, path):
+                    continue
+                try:
+                    os.remove(self.resolve(path))
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    continue
+                db.execute("DELETE FROM pending_unlink WHERE path=?", (path,))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return len(paths)
+    
+    def _is_referenced(self, db, path):
+        digest = os.path.basename(path).split('.')[0]
+        if db.execute("SELECT 1 FROM blobs WHERE hash=? AND content=?", (digest, path)).fetchone():
+            return True
+        return bool(db.execute('''SELECT 1 FROM blobs WHERE storage IN ('file', 'mmap') 
+                                AND content=?''', (path,)).fetchone())
+    
+    def _delete_clips(self, db, where, params=()):
+        rows = db.execute(f"SELECT id, hash FROM clips WHERE {where}", params).fetchall()
+        db.execute(f"DELETE FROM clips WHERE {where}", params)
+        if rows:
+            self.clipboard_fingerprint = None
+        for id, digest in rows:
+            self.cache.pop(id)
+            self._release_blob(db, digest)
+        return [id for id, digest in rows]
+    
+    def _ensure_search_index(self):
+        try:
+            exists = self.db.execute("SELECT 1 FROM sqlite_master WHERE name='clips_fts'").fetchone()
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS clips_fts USING fts5(body)")
+            self.db.execute('''CREATE TRIGGER IF NOT EXISTS clips_fts_delete AFTER DELETE ON clips
+                            BEGIN DELETE FROM clips_fts WHERE rowid = old.id; END''')
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            return
+        if exists:
+            return
+        cursor = self.db.execute('''SELECT c.id, b.content, c.type, b.storage, c.preview 
+                                 FROM clips c JOIN blobs b ON b.hash = c.hash''')
+        for id, content, ctype, storage, preview in cursor.fetchall():
+            try:
+                if storage in ('file', 'mmap'):
+                    with open(content, 'rb') as f:
+                        content = f.read(SEARCH_INDEX_LIMIT) if ctype != 'image' else b''
+                self._index_content(self.db, id, content, ctype, preview)
+            except Exception:
+                pass
+    
+    def _index_content(self, db, id, content, ctype, preview):
+        if not self.fts_enabled:
+            return
+        if ctype in ('text', 'file'):
+            if isinstance(content, bytes):
+                content = content[:SEARCH_INDEX_LIMIT].decode('utf-8', errors='ignore')
+            body = content[:SEARCH_INDEX_LIMIT]
+        else:
+            body = preview or ""
+        db.execute("INSERT OR REPLACE INTO clips_fts (rowid, body) VALUES (?, ?)", (id, body))
+    
+    def _fts_query(self, query):
+        terms = re.findall(r"\w+", query)
+        return " ".join(f'"{term}"*' for term in terms)
+    
+    def search(self, query, limit=SEARCH_PAGE_SIZE, offset=0, db=None):
+        db = db or self.db
+        similar = SIMILAR_QUERY.match(query.strip())
+        if similar:
+            return self.similar_images(int(similar.group(1)), db=db)[offset:offset + limit]
+        match = self._fts_query(query) if self.fts_enabled else ""
+        if match:
+            cur = db.execute('''SELECT c.id, c.preview, c.type, c.pinned
+                             FROM clips_fts JOIN clips c ON c.id = clips_fts.rowid
+                             WHERE clips_fts MATCH ?
+                             ORDER BY clips_fts.rank, c.created DESC
+                             LIMIT ? OFFSET ?''', (match, limit, offset))
+        else:
+            cur = db.execute('''SELECT id, preview, type, pinned FROM clips
+                             WHERE preview LIKE ? ORDER BY created DESC
+                             LIMIT ? OFFSET ?''', (f"%{query}%", limit, offset))
+        return [(row[0], row[1], row[2], bool(row[3])) for row in cur.fetchall()]
+    
+    def _fuzzy_rows(self, db, where="", params=()):
+        return db.execute(f'''SELECT c.id, c.preview, c.type, c.pinned,
+                          CASE WHEN c.type = 'file' AND b.storage = 'db' AND b.codec IS NULL
+                          THEN substr(b.content, 1, {FUZZY_PATH_BYTES}) END
+                          FROM clips c JOIN blobs b ON b.hash = c.hash {where}
+                          ORDER BY c.created, c.id''', params)
+    
+    def _fuzzy_text(self, preview, paths):
+        if not paths:
+            return preview or ""
+        paths = [QUrl(path.strip()).toLocalFile() or path.strip()
+                 for path in paths.decode('utf-8', errors='ignore').splitlines() if path.strip()]
+        return " ".join([os.path.basename(path.rstrip('/')) for path in paths] + paths[:1])
+    
+    def start_fuzzy_index(self):
+        with self.fuzzy_lock:
+            if self.fuzzy_pending is not None:
+                self.fuzzy_stale = True
+                return
+            self.fuzzy_pending = []
+            self.fuzzy_stale = False
+        threading.Thread(target=self._build_fuzzy_index, name="clipvault-fuzzy", daemon=True).start()
+    
+    def _build_fuzzy_index(self):
+        db = self.connect()
+        index = None
+        try:
+            while index is None:
+                index = FuzzyIndex()
+                with self.metrics.timed('clipvault_fuzzy_build_seconds'):
+                    for id, preview, ctype, pinned, paths in self._fuzzy_rows(db):
+                        index.add(id, self._fuzzy_text(preview, paths), pinned)
+                while True:
+                    with self.fuzzy_lock:
+                        pending, self.fuzzy_pending = self.fuzzy_pending, []
+                        if self.fuzzy_stale:
+                            self.fuzzy_stale = False
+                            index = None
+                            break
+                        if not pending:
+                            self.fuzzy_index = index
+                            self.fuzzy_pending = None
+                            break
+                    for op, id in pending:
+                        self._apply_fuzzy_event(index, db, op, id)
+        except Exception:
+            with self.fuzzy_lock:
+                self.fuzzy_pending = None
+        finally:
+            db.close()
+    
+    def _on_fuzzy_event(self, op, id):
+        with self.fuzzy_lock:
+            if self.fuzzy_pending is not None:
+                self.fuzzy_pending.append((op, id))
+                return
+            index = self.fuzzy_index
+        if index is not None:
+            self._apply_fuzzy_event(index, self.db, op, id)
+    
+    def _apply_fuzzy_event(self, index, db, op, id):
+        try:
+            row = None if op == 'removed' else self._fuzzy_rows(db, "WHERE c.id = ?", (id,)).fetchone()
+        except sqlite3.Error:
+            return
+        if row is None:
+            index.remove(id)
+        elif op == 'added':
+            index.add(id, self._fuzzy_text(row[1], row[4]), row[3])
+        else:
+            index.set_pinned(id, row[3])
+    
+    def fuzzy_search(self, query, limit=FUZZY_RESULTS, db=None):
+        db = db or self.db
+        index = self.fuzzy_index
+        if index is None:
+            self.start_fuzzy_index()
+            return self.search(query, limit, db=db) if query.strip() else self.fetch_page(None, limit, db=db)
+        with self.metrics.timed('clipvault_fuzzy_seconds'):
+            ids = index.search(query, limit)
+        if not ids:
+            return []
+        try:
+            rows = {row[0]: row for row in db.execute(f'''SELECT id, preview, type, pinned FROM clips 
+                                                     WHERE id IN ({",".join("?" * len(ids))})''', ids)}
+        except sqlite3.Error:
+            return []
+        return [(id, rows[id][1], rows[id][2], bool(rows[id][3])) for id in ids if id in rows]
     
     def _compress_image(self, img_data):
+        from PIL import Image
         try:
             img = Image.open(io.BytesIO(img_data))
             output = io.BytesIO()
@@ -385,25 +3277,168 @@ class ClipVault:
         except Exception:
             return img_data
     
+    def _image_bits(self, img):
+        ptr = img.constBits()
+        ptr.setsize(img.sizeInBytes())
+        return ptr
+    
+    def _hash_image(self, img):
+        digest = hashlib.sha256(f"{img.width()}x{img.height()}:{int(img.format())}:".encode())
+        digest.update(memoryview(self._image_bits(img)))
+        return digest.hexdigest()
+    
+    def _image_fingerprint(self, img):
+        crc = zlib.crc32(memoryview(self._image_bits(img)))
+        return ('image', img.width(), img.height(), int(img.format()), crc)
+    
+    def _fingerprint(self, content, ctype):
+        if isinstance(content, QImage):
+            return self._image_fingerprint(content)
+        return (ctype, len(content), hash(content))
+    
+    def _compress_qimage(self, img):
+        if img.format() != QImage.Format_RGB32:
+            if img.hasAlphaChannel():
+                flat = QImage(img.size(), QImage.Format_RGB32)
+                flat.fill(Qt.white)
+                painter = QPainter(flat)
+                painter.drawImage(0, 0, img)
+                painter.end()
+                img = flat
+            else:
+                img = img.convertToFormat(QImage.Format_RGB32)
+        from PIL import Image
+        pixels = Image.frombuffer('RGB', (img.width(), img.height()), self._image_bits(img),
+                                  'raw', RGB32_RAWMODE, img.bytesPerLine(), 1)
+        output = io.BytesIO()
+        pixels.save(output, format="JPEG", quality=self.image_quality)
+        return output.getvalue()
+    
     def store_content(self, content, ctype):
-        if isinstance(content, str):
-            content = content.encode('utf-8')
+        trace = ClipTrace(ctype)
+        id, preview = self._persist(self.db, content, ctype, trace)
+        self.segments.sync()
+        self.db.commit()
+        trace.mark('commit')
+        self.events.clip_added.emit(id)
+        self.load_history()
+        trace.mark('notify')
+        self.metrics.finish_trace(trace, id)
+        return preview
+    
+    def _touch_duplicate(self, db, digest, ctype, trace):
+        duplicate = db.execute('''SELECT id, preview FROM clips WHERE hash=? AND type=? 
+                               ORDER BY id DESC LIMIT 1''', (digest, ctype)).fetchone()
+        trace.mark('dedupe')
+        if duplicate:
+            db.execute(f"UPDATE clips SET created={NOW_SQL} WHERE id=?", (duplicate[0],))
+            self.metrics.inc('clipvault_ingest_duplicates_total', type=ctype)
+            trace.mark('write')
+        return duplicate
+    
+    def _text_chunks(self, text, end):
+        for start in range(0, end, STREAM_CHUNK_SIZE):
+            yield text[start:min(start + STREAM_CHUNK_SIZE, end)].encode('utf-8')
+    
+    def _scan_text(self, text, limit):
+        digest = hashlib.sha256()
+        size = 0
+        for start in range(0, len(text), STREAM_CHUNK_SIZE):
+            chunk = text[start:start + STREAM_CHUNK_SIZE].encode('utf-8')
+            if size + len(chunk) > limit:
+                piece = chunk[:limit - size].decode('utf-8', errors='ignore')
+                chunk = piece.encode('utf-8')
+                digest.update(chunk)
+                return digest.hexdigest(), size + len(chunk), start + len(piece), True
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size, len(text), False
+    
+    def _prepare_stream(self, db, text, ctype, trace, skip_duplicates=True):
+        limit = self.max_clip_bytes if self.max_clip_policy == 'truncate' else float('inf')
+        digest, size, end, truncated = self._scan_text(text, limit)
+        if size > self.max_clip_bytes and self.max_clip_policy == 'reject':
+            self.metrics.inc('clipvault_ingest_oversized_total', policy='reject')
+            raise ValueError(f"clip of {size} bytes exceeds the {self.max_clip_bytes} byte limit")
+        trace.mark('encode')
+        if skip_duplicates and db.execute("SELECT 1 FROM clips WHERE hash=? AND type=?", (digest, ctype)).fetchone():
+            return digest, end, None, size, None
+        preview = text[:100] + ('...' if end > 100 else '')
+        if ctype == 'file':
+            preview = f"File: {text[:400].splitlines()[0][:30]}..."
+        if truncated:
+            self.metrics.inc('clipvault_ingest_oversized_total', policy='truncate')
+            preview += f" [truncated to {size // 1024 ** 2} MB]"
+        if db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+            return digest, end, preview, size, None
+        if size > self.max_clip_bytes:
+            self.metrics.inc('clipvault_ingest_oversized_total', policy='reference')
+            preview += f" [not stored, {size // 1024 ** 2} MB]"
+            return digest, end, preview, size, (None, 'reference', 0, None, size, None)
+        codec = INGEST_CODEC if size >= COMPRESSION_THRESHOLD else None
+        compressor = compressor_for(codec) if codec else None
+        with self.segments.stream(size) as span:
+            for chunk in self._text_chunks(text, end):
+                span.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                span.write(compressor.flush())
+        trace.mark('compress')
+        return digest, end, preview, size, (span.path, 'segment', span.length, codec, size, span.offset)
+    
+    def _persist_stream(self, db, text, ctype, trace, prepared=None):
+        digest, end, preview, size, blob = prepared or self._prepare_stream(db, text, ctype, trace)
+        duplicate = self._touch_duplicate(db, digest, ctype, trace)
+        if duplicate:
+            return duplicate
+        if preview is None or not (blob or db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone()):
+            digest, end, preview, size, blob = self._prepare_stream(db, text, ctype, trace, False)
+        stored_size = 0 if self._acquire_blob(db, digest, None, ctype, trace, blob) == 'reference' else size
+        cursor = db.execute(f'''INSERT INTO clips (hash, preview, type, size, created, pinned) 
+                            VALUES (?, ?, ?, ?, {NOW_SQL}, 0)''', (digest, preview, ctype, stored_size))
+        self._index_content(db, cursor.lastrowid, text[:min(end, SEARCH_INDEX_LIMIT)], ctype, preview)
+        trace.mark('write')
+        return cursor.lastrowid, preview
+    
+    def _prepare(self, db, content, ctype, trace, skip_duplicates=True):
+        if isinstance(content, str) and len(content) > STREAM_INGEST_THRESHOLD:
+            return self._prepare_stream(db, content, ctype, trace, skip_duplicates)
+        image = None
+        if isinstance(content, QImage):
+            image = content
+            digest = self._hash_image(image)
+        else:
+            if isinstance(content, str):
+                content = content.encode('utf-8')
+            digest = hashlib.sha256(content).hexdigest()
+        trace.mark('encode')
+        if skip_duplicates and db.execute("SELECT 1 FROM clips WHERE hash=? AND type=?", (digest, ctype)).fetchone():
+            return digest, None, None, None, None
+        thumb = None
+        if ctype == 'image':
+            thumb = self._make_thumbnail(content if image is None else image)
+            if skip_duplicates and thumb is not None and self.fold_similar_images and any(
+                    db.execute("SELECT 1 FROM clips WHERE hash=? AND type=?", (similar, ctype)).fetchone()
+                    for distance, similar in self._image_index(db).search(thumb[1], FOLD_IMAGE_DISTANCE)):
+                return digest, None, None, thumb, None
+        if image is not None:
+            content = self._compress_qimage(image)
+            trace.mark('compress')
         size = len(content)
         preview = ""
-        storage = 'db'
-        file_path = None
         if ctype == 'text':
             try:
-                text_content = content.decode('utf-8', errors='replace')
-                preview = text_content[:100] + ('...' if len(text_content) > 100 else '')
+                text_content = content[:400].decode('utf-8', errors='ignore')
+                preview = text_content[:100] + ('...' if len(content) > len(text_content[:100].encode('utf-8')) else '')
             except:
                 preview = "Text content"
         elif ctype == 'file':
             try:
-                file_paths = content.decode('utf-8', errors='replace')
+                file_paths = content[:400].decode('utf-8', errors='ignore')
                 preview = f"File: {file_paths.splitlines()[0][:30]}..."
             except:
                 preview = "File content"
+        elif image is not None:
+            preview = f"Image ({image.width()}x{image.height()}, {size//1024} KB)"
         else:
             preview = f"Image ({size//1024} KB)"
             if size > 1024:
@@ -412,78 +3447,254 @@ class ClipVault:
                     content = compressed
                     size = len(content)
                     preview = f"Image ({size//1024} KB compressed)"
-        if size > 1024 * 1024:
-            file_path = os.path.join(self.data_dir, f"temp_{datetime.now().strftime('%Y%m%d%H%M%S%f')}")
-            with open(file_path, 'wb') as f:
-                f.write(content)
-            storage = 'file'
-            if size > 10 * 1024 * 1024:
-                storage = 'mmap'
-            self.db.execute('''INSERT INTO clips (preview, type, storage, size, content, pinned) 
-                            VALUES (?, ?, ?, ?, ?, 0)''', 
-                           (preview, ctype, storage, size, file_path))
+        blob = None
+        if not db.execute("SELECT 1 FROM blobs WHERE hash=?", (digest,)).fetchone():
+            blob = self._encode_blob(content, ctype, trace)
+        return digest, content, preview, thumb, blob
+    
+    def _persist(self, db, content, ctype, trace=None, prepared=None):
+        trace = trace or ClipTrace(ctype)
+        if isinstance(content, str) and len(content) > STREAM_INGEST_THRESHOLD:
+            return self._persist_stream(db, content, ctype, trace, prepared)
+        digest, stored, preview, thumb, blob = prepared or self._prepare(db, content, ctype, trace)
+        duplicate = self._touch_duplicate(db, digest, ctype, trace)
+        if duplicate:
+            return duplicate
+        if thumb is not None and self.fold_similar_images:
+            duplicate = self._fold_similar(db, thumb[1], ctype, trace)
+            if duplicate:
+                return duplicate
+        if stored is None:
+            digest, stored, preview, thumb, blob = self._prepare(db, content, ctype, trace, False)
+        content = stored
+        size = len(content)
+        self._acquire_blob(db, digest, content, ctype, trace, blob)
+        if ctype == 'image':
+            self._store_thumbnail(db, digest, thumb)
+        cursor = db.execute(f'''INSERT INTO clips (hash, preview, type, size, created, pinned) 
+                            VALUES (?, ?, ?, ?, {NOW_SQL}, 0)''', 
+                           (digest, preview, ctype, size))
+        self._index_content(db, cursor.lastrowid, content, ctype, preview)
+        trace.mark('write')
+        return cursor.lastrowid, preview
+    
+    def set_cache_budget(self, budget_mb):
+        self.cache_budget_mb = budget_mb
+        self.cache.set_budget(budget_mb * 1024 ** 2)
+    
+    @contextmanager
+    def _stored_view(self, stored, storage, offset, size):
+        if storage == 'reference':
+            yield memoryview(b'')
+        elif storage == 'db':
+            yield memoryview(stored.encode('utf-8') if isinstance(stored, str) else stored)
+        elif storage == 'segment' and size <= MMAP_THRESHOLD:
+            with open(self.resolve(stored), 'rb') as f:
+                f.seek(offset)
+                data = f.read(size)
+            if len(data) < size:
+                raise FileNotFoundError(f"{stored} is truncated")
+            yield memoryview(data)
         else:
-            self.db.execute('''INSERT INTO clips (content, preview, type, storage, size, pinned) 
-                            VALUES (?, ?, ?, ?, ?, 0)''', 
-                           (content, preview, ctype, storage, size))
-        self.db.commit()
-        self.load_history()
-        return preview
+            length = size if storage == 'segment' else None
+            with self.segments.map(self.resolve(stored), offset or 0, length) as handle:
+                yield handle.view
     
-    def get_content(self, id):
-        if id in self.lru_cache:
-            content = self.lru_cache.pop(id)
-            self.lru_cache[id] = content
-            return content
-        row = self.db.execute('''SELECT content, type, storage 
-                              FROM clips WHERE id = ?''', (id,)).fetchone()
-        if not row:
+    def _blob_head(self, db, digest, limit):
+        row = db.execute('''SELECT content, storage, codec, segment_offset, size FROM blobs 
+                         WHERE hash=?''', (digest,)).fetchone()
+        if not row or row[1] == 'reference' or (row[2] and row[2] not in CODECS):
             return None
-        content, ctype, storage = row
+        stored, storage, codec, offset, size = row
+        head = bytearray()
+        with self._stored_view(stored, storage, offset, size) as view:
+            chunks = iter_chunks(view, COMPRESSION_THRESHOLD)
+            for chunk in decompress_chunks(chunks, codec) if codec else chunks:
+                head += chunk
+                if len(head) >= limit:
+                    break
+        return bytes(head[:limit])
+    
+    def start_transfer(self, kind, path):
+        if self.transfer is not None and self.transfer.is_alive():
+            return False
+        self.transfer = threading.Thread(target=self._run_transfer, args=(kind, path),
+                                         name="clipvault-transfer", daemon=True)
+        self.transfer.start()
+        return True
+    
+    def _run_transfer(self, kind, path):
+        db = self.connect()
+        archive = VaultArchive(self, lambda done, total: self.events.transfer_progress.emit(kind, done, total))
         try:
-            if storage == 'file':
-                if not os.path.exists(content):
-                    self.db.execute("DELETE FROM clips WHERE id=?", (id,))
-                    self.db.commit()
-                    return None
-                with open(content, 'rb') as f:
-                    content = f.read()
-            elif storage == 'mmap':
-                if not os.path.exists(content):
-                    self.db.execute("DELETE FROM clips WHERE id=?", (id,))
-                    self.db.commit()
-                    return None
-                with open(content, 'rb') as f:
-                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
-                        content = mm.read()
+            with self.metrics.timed('clipvault_archive_seconds', op=kind):
+                counts = archive.export(db, path) if kind == 'export' else archive.import_archive(db, path)
+            message = ", ".join(f"{value} {name}" for name, value in counts.items())
+        except Exception as e:
+            message = f"failed: {e}"
+        finally:
+            db.close()
+        self.events.transfer_finished.emit(kind, message)
+    
+    def _on_transfer_finished(self, kind, message):
+        if kind == 'import':
+            self.events.history_reset.emit()
+            self.load_history()
+    
+    def _read_blob(self, stored, storage, codec, raw_size, lazy=False, offset=None, size=None):
+        if storage == 'reference':
+            return None
+        if storage == 'segment' and size <= MMAP_THRESHOLD:
+            with open(self.resolve(stored), 'rb') as f:
+                f.seek(offset)
+                data = f.read(size)
+            if len(data) < size:
+                raise FileNotFoundError(f"{stored} is truncated")
+            return b''.join(decompress_chunks([data], codec)) if codec else data
+        if storage in ('mmap', 'segment'):
+            handle = self.segments.map(self.resolve(stored), offset or 0, size if storage == 'segment' else None)
+            if lazy:
+                return DecompressingReader(handle, codec, raw_size) if codec else handle
+            with handle:
+                if codec:
+                    return b''.join(decompress_chunks(handle.chunks(), codec))
+                return bytes(handle)
+        if storage == 'file':
+            with open(self.resolve(stored), 'rb') as f:
+                data = f.read()
+        else:
+            data = stored.encode('utf-8') if isinstance(stored, str) else stored
+        if codec:
+            data = b''.join(decompress_chunks([data], codec))
+        return data
+    
+    def _recompress_blob(self, db, digest):
+        row = db.execute('''SELECT content, storage, codec, size, raw_size, segment_offset 
+                         FROM blobs WHERE hash=?''', (digest,)).fetchone()
+        if not row or row[1] == 'reference':
+            return False
+        stored, storage, codec, size, raw_size, offset = row
+        compressor = compressor_for(COLD_CODEC, CODECS[COLD_CODEC][3])
+        with tempfile.TemporaryFile(dir=self.data_dir) as spool:
+            with self._stored_view(stored, storage, offset, size) as view:
+                chunks = iter_chunks(view, COMPRESSION_THRESHOLD)
+                for chunk in decompress_chunks(chunks, codec) if codec else chunks:
+                    spool.write(compressor.compress(chunk))
+                    if spool.tell() >= size:
+                        break
+                else:
+                    spool.write(compressor.flush())
+            length = spool.tell()
+            spool.seek(0)
+            if length < size and storage == 'db':
+                compressed = spool.read()
+            elif length < size:
+                with self.segments.stream(length) as span:
+                    for chunk in iter(lambda: spool.read(STREAM_CHUNK_SIZE), b''):
+                        span.write(chunk)
+                self.segments.sync()
+                path, offset = span.path, span.offset
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if length >= size:
+                db.execute("UPDATE blobs SET cold = 1 WHERE hash=?", (digest,))
+            elif storage == 'db':
+                db.execute('''UPDATE blobs SET content=?, codec=?, size=?, cold=1 
+                           WHERE hash=?''', (compressed, COLD_CODEC, length, digest))
             else:
-                if isinstance(content, str):
-                    content = content.encode('utf-8')
+                db.execute('''UPDATE blobs SET content=?, storage='segment', segment_offset=?, codec=?, 
+                           size=?, cold=1 WHERE hash=?''', (path, offset, COLD_CODEC, length, digest))
+                if storage != 'segment':
+                    db.execute("INSERT OR IGNORE INTO pending_unlink (path) VALUES (?)", (stored,))
+            db.commit()
         except Exception:
-            self.db.execute("DELETE FROM clips WHERE id=?", (id,))
-            self.db.commit()
+            db.rollback()
+            raise
+        self._flush_unlinks(db)
+        return True
+    
+    def get_content(self, id, lazy=False):
+        content = self.cache.get(id)
+        if content is not None:
+            self.metrics.inc('clipvault_cache_requests_total', result='hit',
+                             storage=self.cache.origins.get(id) or 'unknown')
+            self.prefetcher.record_hit(id)
+            return content
+        for attempt in range(2):
+            row = self._blob_row(self.db, id)
+            if not row:
+                return None
+            ctype, stored, storage, codec, raw_size, offset, size = row
+            self.metrics.inc('clipvault_cache_requests_total', result='miss', storage=storage)
+            try:
+                with self.metrics.timed('clipvault_blob_read_seconds', storage=storage):
+                    content = self._read_blob(stored, storage, codec, raw_size, lazy, offset, size)
+                break
+            except FileNotFoundError:
+                if attempt == 0:
+                    continue
+                if stored in self.segments.missing:
+                    return None
+            except Exception:
+                self.metrics.inc('clipvault_blob_read_errors_total', storage=storage, codec=codec or 'none')
+                return None
+            self._commit_deletions(self.db, self._delete_clips(self.db, "id = ?", (id,)))
             return None
-        self.lru_cache[id] = content
-        if len(self.lru_cache) > self.cache_size:
-            self.lru_cache.popitem(last=False)
+        if not isinstance(content, bytes):
+            return content
+        self.cache.put(id, content, ctype, storage)
         return content
     
+    def _blob_row(self, db, id):
+        return db.execute('''SELECT c.type, b.content, b.storage, b.codec, b.raw_size, 
+                          b.segment_offset, b.size 
+                          FROM clips c JOIN blobs b ON b.hash = c.hash 
+                          WHERE c.id = ?''', (id,)).fetchone()
+    
     def load_history(self):
         try:
             cur = self.db.execute('''SELECT id, preview, type, pinned 
-                                  FROM clips 
-                                  ORDER BY created DESC 
-                                  LIMIT 50''')
+                                  FROM clips WHERE pinned = 0 
+                                  ORDER BY created DESC, id DESC 
+                                  LIMIT ?''', (TRAY_ITEMS,))
             self.history = []
             for row in cur.fetchall():
                 self.history.append((row[0], row[1], row[2], bool(row[3])))
+            self.tray_pinned = self.get_pinned(TRAY_ITEMS)
             self._setup_tray_menu()
         except Exception:
             pass
     
-    def get_pinned(self):
+    def fetch_page(self, before=None, limit=HISTORY_PAGE_SIZE, pinned_only=False, db=None):
+        db = db or self.db
+        where = []
+        params = []
+        if pinned_only:
+            where.append("pinned = 1")
+        if before:
+            where.append("(created < ? OR (created = ? AND id < ?))")
+            params += [before[0], before[0], before[1]]
+        sql = "SELECT id, preview, type, pinned, created FROM clips"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created DESC, id DESC LIMIT ?"
+        try:
+            return db.execute(sql, params + [limit]).fetchall()
+        except Exception:
+            return []
+    
+    def get_row(self, id, db=None):
+        db = db or self.db
+        try:
+            return db.execute('''SELECT id, preview, type, pinned, created 
+                              FROM clips WHERE id=?''', (id,)).fetchone()
+        except Exception:
+            return None
+    
+    def get_pinned(self, limit=-1):
         try:
-            cur = self.db.execute("SELECT id, preview, type FROM clips WHERE pinned=1")
+            cur = self.db.execute('''SELECT id, preview, type FROM clips WHERE pinned=1 
+                                  ORDER BY created DESC, id DESC LIMIT ?''', (limit,))
             return [(row[0], row[1], row[2]) for row in cur.fetchall()]
         except Exception:
             return []
@@ -495,11 +3706,19 @@ class ClipVault:
         except Exception:
             return False
     
+    def get_type(self, id):
+        try:
+            row = self.db.execute("SELECT type FROM clips WHERE id=?", (id,)).fetchone()
+            return row[0] if row else None
+        except Exception:
+            return None
+    
     def toggle_pin(self, id):
         try:
             pinned = self.is_pinned(id)
             self.db.execute("UPDATE clips SET pinned=? WHERE id=?", (1 - int(pinned), id))
             self.db.commit()
+            self.events.clip_changed.emit(id)
             self.load_history()
             return True
         except Exception:
@@ -507,91 +3726,155 @@ class ClipVault:
     
     def delete_item(self, id):
         try:
-            row = self.db.execute("SELECT storage, content FROM clips WHERE id=?", (id,)).fetchone()
-            if row:
-                storage, content = row
-                if storage in ('file', 'mmap'):
-                    if os.path.exists(content):
-                        try:
-                            os.remove(content)
-                        except:
-                            pass
-            self.db.execute("DELETE FROM clips WHERE id=?", (id,))
-            self.db.commit()
-            if id in self.lru_cache:
-                del self.lru_cache[id]
+            self._commit_deletions(self.db, self._delete_clips(self.db, "id = ?", (id,)))
             self.load_history()
             return True
         except Exception:
+            self.db.rollback()
             return False
     
     def clear_unpinned(self):
         try:
-            self.db.execute("DELETE FROM clips WHERE pinned=0")
-            self.db.commit()
+            self._commit_deletions(self.db, self._delete_clips(self.db, "pinned = 0"))
             self.load_history()
             return True
         except Exception:
+            self.db.rollback()
             return False
     
+    def _on_clipboard_changed(self):
+        self.metrics.inc('clipvault_clipboard_events_total')
+        if self.pending_trace is None:
+            self.pending_trace = ClipTrace(None)
+        else:
+            self.metrics.inc('clipvault_clipboard_skipped_total', reason='coalesced')
+        self.clipboard_timer.start(self.clipboard_debounce_ms)
+    
     def check_clipboard(self):
+        trace = self.pending_trace or ClipTrace(None)
+        self.pending_trace = None
+        trace.mark('debounce')
         try:
             mime = self.clipboard.mimeData()
+            if mime.hasFormat(CLIPBOARD_OWNER_MIME):
+                self.metrics.inc('clipvault_clipboard_skipped_total', reason='self')
+                return
             content = None
             ctype = None
             if mime.hasText():
                 content = mime.text()
                 ctype = 'text'
             elif mime.hasImage():
-                img = self.clipboard.image()
-                buffer = QBuffer()
-                buffer.open(QBuffer.ReadWrite)
-                img.save(buffer, "PNG")
-                content = bytes(buffer.data())
+                content = self.clipboard.image()
                 ctype = 'image'
             elif mime.hasUrls():
                 urls = [url.toString() for url in mime.urls()]
                 content = "\n".join(urls)
                 ctype = 'file'
             if content and ctype:
-                self.store_content(content, ctype)
-                if hasattr(self, 'gui') and self.gui.isVisible():
-                    self.gui.refresh_data()
+                fingerprint = self._fingerprint(content, ctype)
+                if fingerprint == self.clipboard_fingerprint:
+                    self.metrics.inc('clipvault_clipboard_skipped_total', reason='unchanged')
+                    return
+                trace.ctype = ctype
+                trace.mark('snapshot')
+                if self.ingest.submit(content, ctype, trace):
+                    self.clipboard_fingerprint = fingerprint
         except Exception:
             pass
     
+    def _on_ingested(self, id):
+        self.events.clip_added.emit(id)
+        self.load_history()
+        trace = self.ingest.traces.pop(id, None)
+        if trace is not None:
+            trace.mark('notify')
+            self.metrics.finish_trace(trace, id)
+    
+    def _on_ingest_dropped(self):
+        if self.gui is not None:
+            self.gui.update_status(f"Clipboard busy, skipped {self.ingest.dropped_count} item(s)")
+    
+    def _on_ipc_command(self, op, id, reply):
+        ok = False
+        try:
+            if op == 'quickpick':
+                self.show_quick_pick()
+                ok = True
+                return
+            if self.get_row(id) is None:
+                return
+            if op == 'paste':
+                self.paste_item(id)
+                ok = True
+            elif op == 'delete':
+                ok = self.delete_item(id)
+            else:
+                ok = self.is_pinned(id) == (op == 'pin') or self.toggle_pin(id)
+        finally:
+            reply.put(ok)
+    
+    def _decode_text(self, content):
+        if isinstance(content, (MappedContent, DecompressingReader)):
+            return content.decode()
+        if isinstance(content, bytes):
+            return content.decode('utf-8', errors='replace')
+        return content
+    
     def paste_item(self, id):
+        content = None
         try:
-            content = self.get_content(id)
+            content = self.get_content(id, lazy=True)
             if not content:
                 return
             row = self.db.execute("SELECT type FROM clips WHERE id=?", (id,)).fetchone()
             if not row: return
             ctype = row[0]
+            mime = QMimeData()
             if ctype == 'text':
-                if isinstance(content, bytes):
-                    content = content.decode('utf-8', errors='replace')
-                self.clipboard.setText(content)
+                text = self._decode_text(content)
+                mime.setText(text)
+                fingerprint = self._fingerprint(text, ctype)
             elif ctype == 'file':
-                if isinstance(content, bytes):
-                    content = content.decode('utf-8', errors='replace')
-                urls = [QUrl(path.strip()) for path in content.splitlines()]
-                mime = QMimeData()
+                urls = [QUrl(path.strip()) for path in self._decode_text(content).splitlines()]
                 mime.setUrls(urls)
-                self.clipboard.setMimeData(mime)
+                fingerprint = self._fingerprint("\n".join(url.toString() for url in urls), ctype)
             else:
                 img = QImage()
-                img.loadFromData(content)
-                self.clipboard.setImage(img)
+                img.loadFromData(content.view if isinstance(content, MappedContent) else content)
+                mime.setImageData(img)
+                fingerprint = self._fingerprint(img, ctype)
+            mime.setData(CLIPBOARD_OWNER_MIME, str(id).encode())
+            self.clipboard_fingerprint = fingerprint
+            self.clipboard.setMimeData(mime)
+            self.db.execute("UPDATE clips SET pastes = pastes + 1 WHERE id=?", (id,))
+            self.db.commit()
         except Exception:
             pass
+        finally:
+            if isinstance(content, (MappedContent, DecompressingReader)):
+                content.close()
     
     def cleanup(self):
-        try:
-            self.mem_log.close()
-        except:
-            pass
-        self.lru_cache.clear()
+        self.startup_timer.stop()
+        self.clipboard_timer.stop()
+        if self.ipc is not None:
+            self.ipc.stop()
+            self.ipc = None
+        if self.gui is not None:
+            self.gui.stop_search()
+        self.ingest.stop()
+        self.retention.stop()
+        self.prefetcher.stop()
+        self.cache.clear()
+        self.segments.close()
+        self.metrics_timer.stop()
+        self.change_timer.stop()
+        self._log_metrics()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        self.metrics.close_log()
     
     def cleanup_and_exit(self):
         self.cleanup()